@@ -7,19 +7,499 @@ from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
 import math
+import os
+import select
+import sys
+import json
+import struct
+import ctypes
 import serial
 import serial.tools.list_ports
 import threading
 import queue
 import time
 import random
+from collections import OrderedDict, deque
+import numpy as np
+
+
+class GeometryCache:
+    """Shared GLU quadric pool used by every sphere/cylinder draw path"""
+
+    def __init__(self):
+        self.quadrics = {}
+        self.live_quadrics = 0
+        self.lists = {}
+        self.compiling = False
+
+    def quadric(self, key='default'):
+        quad = self.quadrics.get(key)
+        if quad is None:
+            quad = gluNewQuadric()
+            self.quadrics[key] = quad
+            self.live_quadrics += 1
+        return quad
+
+    # Spheres and cylinders are tessellated once per (shape, slices, stacks)
+    # into a unit-sized display list and scaled into place; GL_NORMALIZE
+    # keeps the lighting correct under the scale. While another list is
+    # being compiled the geometry is emitted straight into it instead, as
+    # display lists cannot be created inside glNewList/glEndList.
+    def sphere(self, radius, slices, stacks):
+        if self.compiling:
+            gluSphere(self.quadric(), radius, slices, stacks)
+            return
+        mesh = self.display_list(('sphere', slices, stacks),
+                                 lambda: gluSphere(self.quadric(), 1, slices, stacks))
+        glPushMatrix()
+        glScalef(radius, radius, radius)
+        glCallList(mesh)
+        glPopMatrix()
+
+    def cylinder(self, base_radius, top_radius, height, slices):
+        if self.compiling:
+            gluCylinder(self.quadric(), base_radius, top_radius, height, slices, 1)
+            return
+        base, top = round(base_radius / height, 4), round(top_radius / height, 4)
+        mesh = self.display_list(('cylinder', base, top, slices),
+                                 lambda: gluCylinder(self.quadric(), base, top, 1, slices, 1))
+        glPushMatrix()
+        glScalef(height, height, height)
+        glCallList(mesh)
+        glPopMatrix()
+
+    def display_list(self, key, build):
+        list_id = self.lists.get(key)
+        if list_id is None:
+            list_id = glGenLists(1)
+            glNewList(list_id, GL_COMPILE)
+            self.compiling = True
+            try:
+                build()
+            finally:
+                self.compiling = False
+                glEndList()
+            self.lists[key] = list_id
+        return list_id
+
+    def delete_list(self, key):
+        list_id = self.lists.pop(key, None)
+        if list_id is not None:
+            glDeleteLists(list_id, 1)
+
+    def release(self):
+        for quad in self.quadrics.values():
+            gluDeleteQuadric(quad)
+        self.quadrics.clear()
+        self.live_quadrics = 0
+        for list_id in self.lists.values():
+            glDeleteLists(list_id, 1)
+        self.lists.clear()
+
+
+def sphere_mesh(slices, stacks):
+    """Unit sphere as interleaved (x, y, z, nx, ny, nz) GL_TRIANGLES vertices"""
+    theta = np.linspace(0, math.pi, stacks + 1)
+    phi = np.linspace(0, 2 * math.pi, slices + 1)
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    grid = np.stack([np.sin(t) * np.cos(p), np.cos(t), np.sin(t) * np.sin(p)], axis=-1)
+    a, b = grid[:-1, :-1], grid[:-1, 1:]
+    c, d = grid[1:, :-1], grid[1:, 1:]
+    tris = np.stack([a, c, b, b, c, d], axis=2).reshape(-1, 3)
+    return np.hstack([tris, tris]).astype(np.float32)
+
+
+def cylinder_mesh(base_radius, top_radius, height, slices):
+    """Open cylinder along +Y, matching gluCylinder rotated -90 about X"""
+    phi = np.linspace(0, 2 * math.pi, slices + 1)
+    ring = np.stack([np.cos(phi), np.zeros_like(phi), np.sin(phi)], axis=-1)
+    bottom, top = ring * base_radius, ring * top_radius
+    top[:, 1] = height
+    normal = ring.copy()
+    normal[:, 1] = (base_radius - top_radius) / height
+    normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+    verts = np.stack([bottom[:-1], bottom[1:], top[:-1], top[:-1], bottom[1:], top[1:]], axis=1).reshape(-1, 3)
+    norms = np.stack([normal[:-1], normal[1:], normal[:-1], normal[:-1], normal[1:], normal[1:]], axis=1).reshape(-1, 3)
+    return np.hstack([verts, norms]).astype(np.float32)
+
+
+class InstancedRenderer:
+    """Draws many copies of a mesh with one glDrawArraysInstanced call per batch.
+
+    Each batch pairs a mesh VBO with a per-instance buffer of
+    (x, y, z, scale, r, g, b) rows; the vertex shader reproduces the
+    fixed-function GL_LIGHT0 + GL_COLOR_MATERIAL lighting used elsewhere.
+    """
+
+    VERTEX_SHADER = """
+    #version 120
+    attribute vec3 position;
+    attribute vec3 normal;
+    attribute vec4 offset_scale;
+    attribute vec3 color;
+    varying vec4 lit_color;
+    void main() {
+        vec4 eye = gl_ModelViewMatrix * vec4(position * offset_scale.w + offset_scale.xyz, 1.0);
+        vec3 n = normalize(gl_NormalMatrix * normal);
+        vec3 l = normalize(gl_LightSource[0].position.xyz - eye.xyz);
+        float diffuse = max(dot(n, l), 0.0);
+        vec3 light = gl_LightModel.ambient.rgb + gl_LightSource[0].ambient.rgb
+                   + gl_LightSource[0].diffuse.rgb * diffuse;
+        lit_color = vec4(clamp(color * light, 0.0, 1.0), 1.0);
+        gl_Position = gl_ProjectionMatrix * eye;
+    }
+    """
+
+    FRAGMENT_SHADER = """
+    #version 120
+    varying vec4 lit_color;
+    void main() {
+        gl_FragColor = lit_color;
+    }
+    """
+
+    ATTRIBUTES = ('position', 'normal', 'offset_scale', 'color')
+
+    def __init__(self):
+        self.program = None
+        self.batches = {}
+
+    @staticmethod
+    def supported():
+        return bool(glDrawArraysInstanced) and bool(glVertexAttribDivisor) and bool(glCreateShader)
+
+    def compile(self):
+        program = glCreateProgram()
+        for kind, source in ((GL_VERTEX_SHADER, self.VERTEX_SHADER), (GL_FRAGMENT_SHADER, self.FRAGMENT_SHADER)):
+            shader = glCreateShader(kind)
+            glShaderSource(shader, source)
+            glCompileShader(shader)
+            if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+                raise RuntimeError(glGetShaderInfoLog(shader).decode())
+            glAttachShader(program, shader)
+            glDeleteShader(shader)
+        for location, name in enumerate(self.ATTRIBUTES):
+            glBindAttribLocation(program, location, name)
+        glLinkProgram(program)
+        if not glGetProgramiv(program, GL_LINK_STATUS):
+            raise RuntimeError(glGetProgramInfoLog(program).decode())
+        self.program = program
+
+    def upload(self, name, lod_meshes, instances, cells, cell_count):
+        """Upload one mesh per LOD level plus the instances sorted by grid
+        cell, so any run of cells is one contiguous instance range"""
+        if self.program is None:
+            self.compile()
+        self.delete(name)
+        meshes = []
+        for mesh in lod_meshes:
+            mesh_vbo = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, mesh_vbo)
+            glBufferData(GL_ARRAY_BUFFER, mesh.nbytes, mesh, GL_STATIC_DRAW)
+            meshes.append((mesh_vbo, len(mesh)))
+        instance_vbo = glGenBuffers(1)
+        order = np.argsort(cells, kind='stable')
+        instances = np.ascontiguousarray(instances[order], dtype=np.float32)
+        offsets = np.zeros(cell_count + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(cells, minlength=cell_count))
+        glBindBuffer(GL_ARRAY_BUFFER, instance_vbo)
+        glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.batches[name] = (meshes, instance_vbo, offsets)
+
+    @staticmethod
+    def cell_runs(mask):
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8)))
+        return list(zip(edges[::2], edges[1::2]))
+
+    def draw(self, names, visible, lods):
+        runs_by_lod = [self.cell_runs(visible & (lods == level)) for level in range(len(LOD_DISTANCES) + 1)]
+        glUseProgram(self.program)
+        for location in range(4):
+            glEnableVertexAttribArray(location)
+        glVertexAttribDivisor(2, 1)
+        glVertexAttribDivisor(3, 1)
+        for name in names:
+            meshes, instance_vbo, offsets = self.batches[name]
+            for (mesh_vbo, vertex_count), runs in zip(meshes, runs_by_lod):
+                if not runs:
+                    continue
+                glBindBuffer(GL_ARRAY_BUFFER, mesh_vbo)
+                glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
+                glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(12))
+                glBindBuffer(GL_ARRAY_BUFFER, instance_vbo)
+                for first, last in runs:
+                    start, count = int(offsets[first]), int(offsets[last] - offsets[first])
+                    if not count:
+                        continue
+                    glVertexAttribPointer(2, 4, GL_FLOAT, GL_FALSE, 28, ctypes.c_void_p(start * 28))
+                    glVertexAttribPointer(3, 3, GL_FLOAT, GL_FALSE, 28, ctypes.c_void_p(start * 28 + 16))
+                    glDrawArraysInstanced(GL_TRIANGLES, 0, vertex_count, count)
+        glVertexAttribDivisor(2, 0)
+        glVertexAttribDivisor(3, 0)
+        for location in range(4):
+            glDisableVertexAttribArray(location)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glUseProgram(0)
+
+    def delete(self, name):
+        batch = self.batches.pop(name, None)
+        if batch:
+            meshes, instance_vbo, _ = batch
+            glDeleteBuffers(len(meshes) + 1, [mesh_vbo for mesh_vbo, _ in meshes] + [instance_vbo])
+
+    def release(self):
+        for name in list(self.batches):
+            self.delete(name)
+        if self.program is not None:
+            glDeleteProgram(self.program)
+            self.program = None
+
+
+def current_matrices():
+    projection = np.array(glGetFloatv(GL_PROJECTION_MATRIX), dtype=np.float64).reshape(4, 4).T
+    modelview = np.array(glGetFloatv(GL_MODELVIEW_MATRIX), dtype=np.float64).reshape(4, 4).T
+    return projection, modelview
+
+
+def camera_position(modelview):
+    rotation, translation = modelview[:3, :3], modelview[:3, 3]
+    return -rotation.T @ translation
+
+
+def frustum_planes(projection, modelview):
+    """Six (a, b, c, d) world-space clip planes of projection * modelview"""
+    clip = projection @ modelview
+    return np.array([clip[3] + clip[0], clip[3] - clip[0],
+                     clip[3] + clip[1], clip[3] - clip[1],
+                     clip[3] + clip[2], clip[3] - clip[2]])
+
+
+class SpatialGrid:
+    """Uniform grid over the XZ plane bucketing static world objects by layer"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.keys = []
+        self.index = {}
+
+    def cell_of(self, x, z):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(z / self.cell_size)))
+
+    def insert(self, layer, x, z, item):
+        self.cells.setdefault(self.cell_of(x, z), {}).setdefault(layer, []).append(item)
+
+    def items(self, key, layer):
+        return self.cells[key].get(layer, ())
+
+    def freeze(self, margin=3.0, y_min=-1.5, y_max=8.0):
+        # Boxes are padded by the widest footprint (pond, windmill sails) so
+        # objects straddling a cell edge are never culled while visible.
+        self.keys = sorted(self.cells)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        corners = np.array(self.keys, dtype=np.float64).reshape(-1, 2) * self.cell_size
+        count = len(self.keys)
+        self.box_min = np.column_stack([corners[:, 0] - margin, np.full(count, y_min), corners[:, 1] - margin])
+        self.box_max = np.column_stack([corners[:, 0] + self.cell_size + margin, np.full(count, y_max),
+                                        corners[:, 1] + self.cell_size + margin])
+        self.counts = np.array([sum(len(items) for items in self.cells[key].values()) for key in self.keys],
+                               dtype=np.int64)
+        self.centers = (self.box_min + self.box_max) / 2
+        self.centers[:, 1] = 0
+
+    def visible_cells(self, planes):
+        return boxes_visible(planes, self.box_min, self.box_max)
+
+    def lod_levels(self, eye):
+        distances = np.linalg.norm(self.centers - eye, axis=1)
+        return np.searchsorted(LOD_DISTANCES, distances, side='right')
+
+
+class Collider:
+    """Static XZ footprint: a circle of `size` radius, or a square of `size`
+    half side when square is set"""
+    __slots__ = ('index', 'kind', 'x', 'z', 'size', 'square', 'item')
+
+    def __init__(self, index, kind, x, z, size, square=False, item=None):
+        self.index = index
+        self.kind = kind
+        self.x = x
+        self.z = z
+        self.size = size
+        self.square = square
+        self.item = item
+
+    @property
+    def extent(self):
+        """Radius around (x, z) that holds the whole footprint"""
+        return self.size * math.sqrt(2) if self.square else self.size
+
+    def distance(self, x, z):
+        """Distance from (x, z) to the footprint, 0 inside it"""
+        dx, dz = x - self.x, z - self.z
+        if self.square:
+            return math.hypot(max(abs(dx) - self.size, 0.0), max(abs(dz) - self.size, 0.0))
+        return max(math.hypot(dx, dz) - self.size, 0.0)
+
+    def push(self, x, z, radius):
+        """Move a circle of radius centred at (x, z) out of the footprint"""
+        dx, dz = x - self.x, z - self.z
+        if not self.square:
+            d = math.hypot(dx, dz)
+            if d >= self.size + radius:
+                return x, z
+            if d == 0:
+                return x, self.z + self.size + radius
+            scale = (self.size + radius) / d
+            return self.x + dx * scale, self.z + dz * scale
+        ex, ez = max(abs(dx) - self.size, 0.0), max(abs(dz) - self.size, 0.0)
+        d = math.hypot(ex, ez)
+        if d >= radius:
+            return x, z
+        if d > 0:
+            scale = radius / d
+            return (x + math.copysign(ex * scale - ex, dx) if ex else x,
+                    z + math.copysign(ez * scale - ez, dz) if ez else z)
+        # Centre inside the square: leave through the nearest side
+        if self.size - abs(dx) < self.size - abs(dz):
+            return self.x + math.copysign(self.size + radius, dx), z
+        return x, self.z + math.copysign(self.size + radius, dz)
+
+
+class SpatialHash:
+    """Static colliders bucketed by every cell their footprint overlaps,
+    answering 'what is within r of (x, z)' from the few cells around it"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.colliders = []
+        self.reaches = {}
+
+    def cell_range(self, x, z, extent):
+        size = self.cell_size
+        return (range(int(math.floor((x - extent) / size)), int(math.floor((x + extent) / size)) + 1),
+                range(int(math.floor((z - extent) / size)), int(math.floor((z + extent) / size)) + 1))
+
+    def _add(self, table, collider, extent):
+        columns, rows = self.cell_range(collider.x, collider.z, extent)
+        for cx in columns:
+            for cz in rows:
+                table.setdefault((cx, cz), []).append(collider)
+
+    def _discard(self, table, collider, extent, gone):
+        columns, rows = self.cell_range(collider.x, collider.z, extent)
+        for cx in columns:
+            for cz in rows:
+                bucket = [c for c in table.get((cx, cz), ()) if c.index not in gone]
+                if bucket:
+                    table[(cx, cz)] = bucket
+                else:
+                    table.pop((cx, cz), None)
+
+    # insert() and remove() patch only the cells a footprint touches, in
+    # self.cells and in every cached reach(), so the caches stay warm while
+    # streamed chunks come and go
+    def insert(self, kind, x, z, size, square=False, item=None):
+        collider = Collider(len(self.colliders), kind, x, z, size, square, item)
+        self.colliders.append(collider)
+        self._add(self.cells, collider, collider.extent)
+        for radius, buckets in self.reaches.items():
+            self._add(buckets, collider, collider.extent + radius)
+        return collider
+
+    def remove(self, colliders):
+        """Drop colliders returned by insert(); the rest are renumbered in order"""
+        gone = {collider.index for collider in colliders}
+        if not gone:
+            return
+        for collider in colliders:
+            self._discard(self.cells, collider, collider.extent, gone)
+            for radius, buckets in self.reaches.items():
+                self._discard(buckets, collider, collider.extent + radius, gone)
+        self.colliders = [c for c in self.colliders if c.index not in gone]
+        for index, collider in enumerate(self.colliders):
+            collider.index = index
+
+    def query_radius(self, x, z, r, kind=None):
+        """Colliders whose footprint comes within r of (x, z), in insertion order"""
+        columns, rows = self.cell_range(x, z, r)
+        found = [collider for cx in columns for cz in rows for collider in self.cells.get((cx, cz), ())
+                 if (kind is None or collider.kind == kind) and collider.distance(x, z) <= r]
+        if len(columns) * len(rows) > 1 and len(found) > 1:
+            # A collider spanning several of the cells is listed in each
+            found = sorted({collider.index: collider for collider in found}.values(), key=lambda c: c.index)
+        return found
+
+    def reach(self, radius):
+        """Per cell, the colliders a circle of radius centred in it can touch (cached)"""
+        buckets = self.reaches.get(radius)
+        if buckets is None:
+            buckets = self.reaches[radius] = {}
+            for c in self.colliders:
+                self._add(buckets, c, c.extent + radius)
+        return buckets
+
+    def resolve(self, x, z, radius, passes=2):
+        """(x, z) moved out of every collider a circle of radius overlaps"""
+        buckets = self.reach(radius)
+        for _ in range(passes):
+            bucket = buckets.get((int(math.floor(x / self.cell_size)), int(math.floor(z / self.cell_size))))
+            hits = [c for c in bucket if c.distance(x, z) < radius] if bucket else None
+            if not hits:
+                break
+            for collider in hits:
+                x, z = collider.push(x, z, radius)
+        return x, z
+
+    def pack(self, radius):
+        """Dense arrays for FoxSwarm: reach(radius) as a grid of collider
+        indices padded with -1"""
+        count = len(self.colliders)
+        arrays = {
+            'x': np.array([c.x for c in self.colliders]),
+            'z': np.array([c.z for c in self.colliders]),
+            'size': np.array([c.size for c in self.colliders]),
+            'square': np.array([c.square for c in self.colliders], dtype=bool),
+            'cell_size': self.cell_size,
+        }
+        if not count:
+            arrays.update(origin=(0, 0), table=np.full((1, 1, 1), -1, dtype=np.int64))
+            return arrays
+        buckets = self.reach(radius)
+        keys = np.array(list(buckets))
+        origin = keys.min(axis=0)
+        shape = keys.max(axis=0) - origin + 1
+        table = np.full((shape[0], shape[1], max(len(b) for b in buckets.values())), -1, dtype=np.int64)
+        for (cx, cz), bucket in buckets.items():
+            table[cx - origin[0], cz - origin[1], :len(bucket)] = [c.index for c in bucket]
+        arrays.update(origin=tuple(int(v) for v in origin), table=table)
+        return arrays
+
+
+# (part mesh, joint offset from the fox root); each joint also rotates about X
+FOX_SKELETON = (
+    ('body', (0, 0, 0)),
+    ('head', (0, 1.5, 0)),
+    ('arm', (-0.35, 0.4, 0.2)),
+    ('arm', (0.35, 0.4, 0.2)),
+    ('leg', (-0.3, 0.2, -0.2)),
+    ('leg', (0.3, 0.2, -0.2)),
+    ('tail', (0, 0.7, -0.5)),
+)
+
 
 class Fox3D:
     """A cute cartoon 3D fox character with articulated limbs"""
     
-    def __init__(self):
+    def __init__(self, geometry=None):
+        self.geometry = geometry or GeometryCache()
         self.position = [0, 0, -10]
         self.rotation = [0, 0, 0]
+        self.previous_position = list(self.position)
+        self.previous_rotation = list(self.rotation)
+        self.colliders = None      # SpatialHash that movement slides along
         self.arm_rotation = 0
         self.leg_rotation = 0
         self.head_tilt = 0
@@ -41,6 +521,11 @@ class Fox3D:
             'inner_ear': (1.0, 0.8, 0.8),
             'tail_tip': (1.0, 1.0, 1.0)
         }
+        
+        self.joints = np.zeros((len(FOX_SKELETON), 4, 4), dtype=np.float32)
+        for joint, (_, offset) in zip(self.joints, FOX_SKELETON):
+            joint[0, 0] = joint[3, 3] = 1
+            joint[3, :3] = offset
     
     def draw_cube(self, width, height, depth, color):
         glColor3f(*color)
@@ -56,24 +541,49 @@ class Fox3D:
     
     def draw_sphere(self, radius, color, slices=20, stacks=20):
         glColor3f(*color)
-        quad = gluNewQuadric()
-        gluSphere(quad, radius, slices, stacks)
+        self.geometry.sphere(radius, slices, stacks)
     
     def draw_cylinder(self, radius, height, color, slices=20):
         glColor3f(*color)
-        quad = gluNewQuadric()
-        gluCylinder(quad, radius, radius, height, slices, 1)
+        self.geometry.cylinder(radius, radius, height, slices)
     
     def draw_cone(self, base_radius, height, color, slices=20):
         glColor3f(*color)
-        quad = gluNewQuadric()
-        gluCylinder(quad, base_radius, 0, height, slices, 1)
+        self.geometry.cylinder(base_radius, 0, height, slices)
     
-    def draw_head(self):
+    # The fox is drawn from five rigid part meshes (body, head, arm, leg,
+    # tail) baked once into display lists. Each frame only the joint
+    # transforms in joint_transforms() are recomputed and the parts are
+    # replayed under them, so extra foxes cost a handful of calls each.
+    def build_body(self):
+        glPushMatrix()
+        glTranslatef(0, 0.6, 0)
+        
+        glPushMatrix()
+        glScalef(1.0, 1.2, 0.9)
+        self.draw_sphere(0.5, self.colors['body'])
+        glPopMatrix()
+        
         glPushMatrix()
-        glTranslatef(0, 1.5, 0)
-        glRotatef(self.head_tilt, 1, 0, 0)
+        glTranslatef(0, -0.1, 0.4)
+        glScalef(0.7, 1.0, 0.6)
+        self.draw_sphere(0.4, self.colors['belly'])
+        glPopMatrix()
+        
+        glPopMatrix()
         
+        for side in (-1, 1):
+            glPushMatrix()
+            glTranslatef(side * 0.35, 0.4, 0.2)
+            self.draw_sphere(0.12, self.colors['body'])
+            glPopMatrix()
+            
+            glPushMatrix()
+            glTranslatef(side * 0.3, 0.2, -0.2)
+            self.draw_sphere(0.14, self.colors['body'])
+            glPopMatrix()
+    
+    def build_head(self):
         self.draw_sphere(0.5, self.colors['body'])
         
         glPushMatrix()
@@ -144,39 +654,8 @@ class Fox3D:
         glTranslatef(0.25, 0.82, 0.08)
         self.draw_sphere(0.08, self.colors['dark'])
         glPopMatrix()
-        
-        glPopMatrix()
-    
-    def draw_body(self):
-        glPushMatrix()
-        glTranslatef(0, 0.6, 0)
-        
-        glPushMatrix()
-        glScalef(1.0, 1.2, 0.9)
-        self.draw_sphere(0.5, self.colors['body'])
-        glPopMatrix()
-        
-        glPushMatrix()
-        glTranslatef(0, -0.1, 0.4)
-        glScalef(0.7, 1.0, 0.6)
-        self.draw_sphere(0.4, self.colors['belly'])
-        glPopMatrix()
-        
-        glPopMatrix()
     
-    def draw_arm(self, side):
-        glPushMatrix()
-        glTranslatef(side * 0.35, 0.4, 0.2)
-        
-        self.draw_sphere(0.12, self.colors['body'])
-        
-        if self.is_waving and side == 1:
-            glRotatef(math.sin(self.animation_frame * 0.2) * 45 + 90, 1, 0, 0)
-        elif self.is_walking or self.is_dancing:
-            glRotatef(math.sin(self.arm_rotation + side * math.pi) * 25, 1, 0, 0)
-        else:
-            glRotatef(math.sin(self.arm_rotation + side * math.pi) * 5, 1, 0, 0)
-        
+    def build_arm(self):
         glPushMatrix()
         glTranslatef(0, -0.25, 0)
         glRotatef(-90, 1, 0, 0)
@@ -196,20 +675,8 @@ class Fox3D:
         glScalef(1.2, 0.6, 1.2)
         self.draw_sphere(0.12, self.colors['dark'])
         glPopMatrix()
-        
-        glPopMatrix()
     
-    def draw_leg(self, side):
-        glPushMatrix()
-        glTranslatef(side * 0.3, 0.2, -0.2)
-        
-        self.draw_sphere(0.14, self.colors['body'])
-        
-        if self.is_dancing:
-            glRotatef(math.sin(self.animation_frame * 0.3 + side * math.pi) * 30, 1, 0, 0)
-        elif self.is_walking:
-            glRotatef(math.sin(self.walk_cycle + side * math.pi) * 25, 1, 0, 0)
-        
+    def build_leg(self):
         glPushMatrix()
         glTranslatef(0, -0.3, 0)
         glRotatef(-90, 1, 0, 0)
@@ -234,20 +701,8 @@ class Fox3D:
         glScalef(1.2, 0.6, 1.2)
         self.draw_sphere(0.13, self.colors['dark'])
         glPopMatrix()
-        
-        glPopMatrix()
     
-    def draw_tail(self):
-        glPushMatrix()
-        glTranslatef(0, 0.7, -0.5)
-        
-        self.tail_wave += 0.05
-        tail_angle = math.sin(self.tail_wave) * 10
-        if self.is_dancing:
-            tail_angle = math.sin(self.animation_frame * 0.2) * 30
-        
-        glRotatef(45 + tail_angle, 1, 0, 0)
-        
+    def build_tail(self):
         segments = 5
         for i in range(segments):
             t = i / segments
@@ -264,8 +719,42 @@ class Fox3D:
                 self.draw_sphere(0.25, self.colors['body'])
             
             glPopMatrix()
-        
-        glPopMatrix()
+    
+    def part_list(self, part):
+        key = ('fox', part, tuple(sorted(self.colors.items())))
+        return self.geometry.display_list(key, getattr(self, 'build_' + part))
+    
+    def arm_angle(self, side):
+        if self.is_waving and side == 1:
+            return math.sin(self.animation_frame * 0.2) * 45 + 90
+        elif self.is_walking or self.is_dancing:
+            return math.sin(self.arm_rotation + side * math.pi) * 25
+        return math.sin(self.arm_rotation + side * math.pi) * 5
+    
+    def leg_angle(self, side):
+        if self.is_dancing:
+            return math.sin(self.animation_frame * 0.3 + side * math.pi) * 30
+        elif self.is_walking:
+            return math.sin(self.walk_cycle + side * math.pi) * 25
+        return 0
+    
+    def tail_angle(self):
+        if self.is_dancing:
+            return math.sin(self.animation_frame * 0.2) * 30
+        return math.sin(self.tail_wave) * 10
+    
+    def joint_transforms(self):
+        """Column-major joint matrices, one per FOX_SKELETON entry, relative to the fox root"""
+        angles = (0, self.head_tilt, self.arm_angle(-1), self.arm_angle(1),
+                  self.leg_angle(-1), self.leg_angle(1), 45 + self.tail_angle())
+        radians = np.radians(angles)
+        cos, sin = np.cos(radians), np.sin(radians)
+        joints = self.joints
+        joints[:, 1, 1] = cos
+        joints[:, 1, 2] = sin
+        joints[:, 2, 1] = -sin
+        joints[:, 2, 2] = cos
+        return joints
     
     def move_continuous(self, direction, speed=0.15):
         angle_rad = math.radians(self.rotation[1])
@@ -283,6 +772,9 @@ class Fox3D:
             self.position[0] += math.cos(angle_rad) * speed
             self.position[2] -= math.sin(angle_rad) * speed
         
+        if self.colliders:
+            self.position[0], self.position[2] = self.colliders.resolve(self.position[0], self.position[2], FOX_RADIUS)
+        
         if not self.is_walking:
             self.is_walking = True
     
@@ -303,28 +795,314 @@ class Fox3D:
         else:
             self.arm_rotation += 0.02
             self.walk_cycle = 0
+        
+        self.tail_wave += 0.05
     
-    def draw(self):
+    def save_previous(self):
+        self.previous_position[:] = self.position
+        self.previous_rotation[:] = self.rotation
+    
+    def render_position(self, alpha=1.0):
+        return [p + (c - p) * alpha for p, c in zip(self.previous_position, self.position)]
+    
+    def render_rotation(self, alpha=1.0):
+        return [p + (c - p) * alpha for p, c in zip(self.previous_rotation, self.rotation)]
+    
+    def draw(self, alpha=1.0):
+        rotation = self.render_rotation(alpha)
         glPushMatrix()
-        glTranslatef(*self.position)
+        glTranslatef(*self.render_position(alpha))
         glTranslatef(0, self.jump_offset, 0)
-        glRotatef(self.rotation[0], 1, 0, 0)
-        glRotatef(self.rotation[1], 0, 1, 0)
-        glRotatef(self.rotation[2], 0, 0, 1)
-        
-        self.draw_body()
-        self.draw_head()
-        self.draw_arm(-1)
-        self.draw_arm(1)
-        self.draw_leg(-1)
-        self.draw_leg(1)
-        self.draw_tail()
+        glRotatef(rotation[0], 1, 0, 0)
+        glRotatef(rotation[1], 0, 1, 0)
+        glRotatef(rotation[2], 0, 0, 1)
+        
+        for (part, _), joint in zip(FOX_SKELETON, self.joint_transforms()):
+            glPushMatrix()
+            glMultMatrixf(joint)
+            glCallList(self.part_list(part))
+            glPopMatrix()
         
         glPopMatrix()
 
 
+TREE_TRUNK_COLOR = (0.4, 0.25, 0.1)
+TREE_CANOPY_COLOR = (0.1, 0.5, 0.1)
+BUSH_COLOR = (0.15, 0.6, 0.15)
+FLOWER_STEM_COLOR = (0.1, 0.6, 0.1)
+
+CELEBRATION_SECONDS = 1.0
+
+GRID_CELL_SIZE = 10.0
+STATIC_LAYERS = ('trees', 'bushes', 'flowers', 'houses', 'landmarks')
+LAYER_BATCHES = {
+    'trees': ('tree_trunk', 'tree_canopy'),
+    'bushes': ('bush',),
+    'flowers': ('flower_stem', 'flower_head'),
+}
+
+# Level of detail: grid cells closer than LOD_DISTANCES[0] use level 0,
+# beyond the last threshold the coarsest level. Slices (and stacks for
+# spheres) per level for each vegetation mesh.
+LOD_DISTANCES = (20.0, 45.0)
+LOD_TESSELLATION = {
+    'tree_trunk': (8, 6, 4),
+    'tree_canopy': (12, 8, 5),
+    'bush': (10, 6, 4),
+    'flower_stem': (4, 3, 3),
+    'flower_head': (6, 4, 3),
+}
+
+# Collision: static footprints in the XZ plane, circles (radius) or squares
+# (half side). The pond and bridge lie flat and stay walkable, and landmark
+# footprints plus FOX_RADIUS stay inside TREASURE_RADIUS so every treasure
+# can still be reached.
+FOX_RADIUS = 0.4
+COLLIDER_CELL_SIZE = 4.0
+TREE_COLLIDER = 0.2        # radius per unit of tree size (trunk plus bark)
+BUSH_COLLIDER = 0.5        # radius per unit of bush size
+HOUSE_HALF_SIZE = 1.5
+LANDMARK_COLLIDERS = {
+    'well': (0.8, False),
+    'statue': (0.75, True),
+    'rock': (1.8, False),
+    'windmill': (0.8, False),
+}
+TREASURE_RADIUS = 3.0
+HOUSE_LABEL_RADIUS = 5.0
+
+
+# Streaming world: procedural chunks on a grid whose origin lines chunk edges
+# up with the hand-made home area (x -50..50, z -90..50), which is never
+# replaced by chunks.
+CHUNK_SIZE = 20.0
+CHUNK_ORIGIN = (-50.0, -90.0)
+HOME_CHUNKS = (range(0, 5), range(0, 7))
+CHUNK_VIEW_RADIUS = 5
+CHUNK_CACHE_SIZE = 160
+CHUNK_BAKES_PER_FRAME = 2
+CHUNK_LAYERS = ('trees', 'bushes', 'flowers')
+
+
+def chunk_of(x, z):
+    return (int(math.floor((x - CHUNK_ORIGIN[0]) / CHUNK_SIZE)),
+            int(math.floor((z - CHUNK_ORIGIN[1]) / CHUNK_SIZE)))
+
+
+def is_home_chunk(key):
+    return key[0] in HOME_CHUNKS[0] and key[1] in HOME_CHUNKS[1]
+
+
+def generate_chunk(seed, cx, cz, density=1):
+    """Deterministic contents of chunk (cx, cz), in the same tuple formats as
+    TreasureHuntEnvironment's lists. Pure data, safe to run off the GL thread."""
+    rng = random.Random(f"{seed}:{cx}:{cz}")
+    x0 = CHUNK_ORIGIN[0] + cx * CHUNK_SIZE
+    z0 = CHUNK_ORIGIN[1] + cz * CHUNK_SIZE
+    point = lambda: (x0 + rng.uniform(0, CHUNK_SIZE), z0 + rng.uniform(0, CHUNK_SIZE))
+    
+    forest = rng.random() < 0.3
+    trees = [(*point(), rng.uniform(0.7, 1.8)) for _ in range((14 if forest else 4) * density)]
+    bushes = [(*point(), rng.uniform(0.3, 0.7)) for _ in range(3 * density)]
+    flowers = []
+    if rng.random() < 0.15:
+        mx, mz = point()
+        for _ in range(20 * density):
+            angle, radius = rng.uniform(0, 2 * math.pi), rng.uniform(0, 4)
+            color = rng.choice([(1.0, 0.2, 0.4), (1.0, 0.8, 0.0), (0.6, 0.3, 0.9), (1.0, 0.5, 0.8)])
+            flowers.append((mx + math.cos(angle) * radius, mz + math.sin(angle) * radius, color))
+    return {'trees': trees, 'bushes': bushes, 'flowers': flowers}
+
+
+def boxes_visible(planes, box_min, box_max):
+    """Which axis-aligned boxes (rows of box_min/box_max) touch the frustum"""
+    normals, offsets = planes[:, :3], planes[:, 3]
+    farthest = np.where(normals[:, None, :] > 0, box_max[None], box_min[None])
+    return np.all((farthest * normals[:, None, :]).sum(axis=2) + offsets[:, None] >= 0, axis=0)
+
+
+class ChunkStreamer:
+    """Keeps the chunks around the camera loaded for TreasureHuntEnvironment.
+
+    Generation runs on a background worker; baking display lists and evicting
+    them happen on the render thread inside update()/draw(), a few chunks per
+    frame at most, so the frame never waits on world generation.
+    """
+
+    def __init__(self, environment, radius=CHUNK_VIEW_RADIUS, capacity=CHUNK_CACHE_SIZE):
+        self.environment = environment
+        self.radius = radius
+        self.capacity = capacity
+        self.chunks = OrderedDict()
+        self.pending = set()
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.stats = {'generated': 0, 'evicted': 0, 'baked': 0}
+        self.worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self.worker.start()
+
+    def _worker_loop(self):
+        env = self.environment
+        while True:
+            key = self.requests.get()
+            if key is None:
+                return
+            self.results.put((key, generate_chunk(env.seed, key[0], key[1], env.density)))
+
+    def bounds(self, key):
+        x0 = CHUNK_ORIGIN[0] + key[0] * CHUNK_SIZE
+        z0 = CHUNK_ORIGIN[1] + key[1] * CHUNK_SIZE
+        return x0, z0, x0 + CHUNK_SIZE, z0 + CHUNK_SIZE
+
+    def wanted(self, eye):
+        """Non-home chunk keys within the view radius, nearest first"""
+        cx, cz = chunk_of(eye[0], eye[2])
+        keys = []
+        for dx in range(-self.radius, self.radius + 1):
+            for dz in range(-self.radius, self.radius + 1):
+                key = (cx + dx, cz + dz)
+                if dx * dx + dz * dz > self.radius * self.radius:
+                    continue
+                if is_home_chunk(key):
+                    continue
+                keys.append((dx * dx + dz * dz, key))
+        return [key for _, key in sorted(keys)]
+
+    def update(self, eye):
+        for key in self.wanted(eye):
+            if key in self.chunks:
+                self.chunks.move_to_end(key)
+            elif key not in self.pending:
+                self.pending.add(key)
+                self.requests.put(key)
+        while True:
+            try:
+                key, items = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending.discard(key)
+            self.chunks[key] = {'items': items, 'lists': {}, 'list_keys': set()}
+            self.stats['generated'] += 1
+        while len(self.chunks) > self.capacity:
+            key, chunk = next(iter(self.chunks.items()))
+            self.release_chunk(key)
+            del self.chunks[key]
+            self.stats['evicted'] += 1
+
+    def bake(self, key, lod):
+        env = self.environment
+        chunk = self.chunks[key]
+        items = chunk['items']
+        ground_key = ('chunk', id(env), key, 'ground')
+        lists = {'ground': env.geometry.display_list(ground_key, lambda: self.draw_chunk_ground(key))}
+        chunk['list_keys'].add(ground_key)
+        for layer in CHUNK_LAYERS:
+            if items[layer]:
+                build = lambda layer=layer: env.layer_drawers[layer](items[layer], lod)
+                list_key = ('chunk', id(env), key, layer, lod)
+                lists[layer] = env.geometry.display_list(list_key, build)
+                chunk['list_keys'].add(list_key)
+        chunk['lists'][lod] = lists
+        self.stats['baked'] += 1
+        return lists
+
+    def draw_chunk_ground(self, key):
+        x0, z0, x1, z1 = self.bounds(key)
+        glDisable(GL_LIGHTING)
+        glColor3f(0.2, 0.6, 0.2)
+        glBegin(GL_QUADS)
+        glVertex3f(x0, -1.5, z1)
+        glVertex3f(x1, -1.5, z1)
+        glVertex3f(x1, -1.5, z0)
+        glVertex3f(x0, -1.5, z0)
+        glEnd()
+        glColor3f(0.25, 0.65, 0.25)
+        glBegin(GL_LINES)
+        for i in range(0, int(CHUNK_SIZE), 5):
+            glVertex3f(x0 + i, -1.49, z0)
+            glVertex3f(x0 + i, -1.49, z1)
+            glVertex3f(x0, -1.49, z0 + i)
+            glVertex3f(x1, -1.49, z0 + i)
+        glEnd()
+        glEnable(GL_LIGHTING)
+
+    def draw(self, planes, eye, lod_enabled=True):
+        """Draw loaded chunks in the frustum; returns how many were drawn"""
+        if not self.chunks:
+            return 0
+        keys = list(self.chunks)
+        bounds = np.array([self.bounds(key) for key in keys])
+        count = len(keys)
+        box_min = np.column_stack([bounds[:, 0] - 3, np.full(count, -1.5), bounds[:, 1] - 3])
+        box_max = np.column_stack([bounds[:, 2] + 3, np.full(count, 8.0), bounds[:, 3] + 3])
+        visible = boxes_visible(planes, box_min, box_max) if planes is not None else np.ones(count, dtype=bool)
+        centers = (bounds[:, :2] + bounds[:, 2:]) / 2
+        distances = np.hypot(centers[:, 0] - eye[0], centers[:, 1] - eye[2])
+        lods = np.searchsorted(LOD_DISTANCES, distances, side='right') if lod_enabled else np.zeros(count, int)
+        baked = 0
+        drawn = 0
+        for i in np.flatnonzero(visible):
+            chunk = self.chunks[keys[i]]
+            lists = chunk['lists'].get(lods[i])
+            if lists is None:
+                if baked < CHUNK_BAKES_PER_FRAME:
+                    lists = self.bake(keys[i], lods[i])
+                    baked += 1
+                elif chunk['lists']:
+                    lists = next(iter(chunk['lists'].values()))
+                else:
+                    continue
+            for list_id in lists.values():
+                glCallList(list_id)
+            drawn += 1
+        return drawn
+
+    def release_chunk(self, key):
+        env = self.environment
+        for list_key in self.chunks[key]['list_keys']:
+            env.geometry.delete_list(list_key)
+
+    def release(self):
+        for key in list(self.chunks):
+            self.release_chunk(key)
+        self.chunks.clear()
+        self.pending.clear()
+
+    def stop(self):
+        self.requests.put(None)
+
+
 class TreasureHuntEnvironment:
-    def __init__(self):
+    # render_mode: 'instanced' (vegetation via InstancedRenderer, the rest
+    # baked), 'baked' (display lists only) or 'immediate'. All world layout and
+    # treasure choices come from self.rng so a seed reproduces a session.
+    # world='streaming' surrounds the home area with endless procedural chunks.
+    def __init__(self, geometry=None, render_mode='instanced', density=1, verbose=True, seed=None,
+                 world='fixed'):
+        self.geometry = geometry or GeometryCache()
+        self.verbose = verbose
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.render_mode = render_mode
+        self.density = density
+        self.static_lists = {}
+        self.cell_lists = []
+        self.instanced = None
+        self.frustum_culling = True
+        self.level_of_detail = True
+        self.cull_stats = {'submitted': 0, 'culled': 0}
+        self.profiler = FrameProfiler()
+        self.world = world
+        self.streamer = None
+        self.collider_chunk = None
+        self.collider_chunks = {}
+        self.layer_drawers = {
+            'trees': self.draw_trees,
+            'bushes': self.draw_bushes,
+            'flowers': self.draw_flowers,
+            'houses': self.draw_houses,
+            'landmarks': self.draw_landmarks,
+        }
         self.trees = []
         self.bushes = []
         self.flowers = []
@@ -334,22 +1112,26 @@ class TreasureHuntEnvironment:
         self.treasure_found = False
         self.used_landmarks = []
         self.all_landmarks_used = False
+        self.celebration = 0
+        self.celebration_pos = None
 
         self.generate_environment()
+        self.build_spatial_index()
+        self.build_colliders()
         self.spawn_new_treasure()
     
     def generate_environment(self):
-        for _ in range(40):
-            x = random.uniform(-40, 40)
-            z = random.uniform(-80, -40)
-            size = random.uniform(0.8, 1.8)
+        for _ in range(40 * self.density):
+            x = self.rng.uniform(-40, 40)
+            z = self.rng.uniform(-80, -40)
+            size = self.rng.uniform(0.8, 1.8)
             self.trees.append((x, z, size))
         
-        for _ in range(30):
-            x = random.uniform(-40, 40)
-            z = random.uniform(-40, 40)
+        for _ in range(30 * self.density):
+            x = self.rng.uniform(-40, 40)
+            z = self.rng.uniform(-40, 40)
             if abs(x) > 5 or abs(z) > 5:
-                size = random.uniform(0.7, 1.5)
+                size = self.rng.uniform(0.7, 1.5)
                 self.trees.append((x, z, size))
         
         house_positions = [
@@ -357,24 +1139,24 @@ class TreasureHuntEnvironment:
             (-35, 5), (-28, 8), (-35, 15)
         ]
         for x, z in house_positions:
-            color = random.choice([
+            color = self.rng.choice([
                 (0.8, 0.3, 0.2),
                 (0.7, 0.6, 0.3),
                 (0.5, 0.4, 0.3),
             ])
             self.houses.append((x, z, color))
         
-        for _ in range(60):
-            x = random.uniform(-45, 45)
-            z = random.uniform(-85, 45)
+        for _ in range(60 * self.density):
+            x = self.rng.uniform(-45, 45)
+            z = self.rng.uniform(-85, 45)
             if abs(x) > 3 or abs(z) > 3:
-                size = random.uniform(0.3, 0.7)
+                size = self.rng.uniform(0.3, 0.7)
                 self.bushes.append((x, z, size))
         
-        for _ in range(80):
-            x = random.uniform(20, 40)
-            z = random.uniform(-20, 20)
-            color = random.choice([
+        for _ in range(80 * self.density):
+            x = self.rng.uniform(20, 40)
+            z = self.rng.uniform(-20, 20)
+            color = self.rng.choice([
                 (1.0, 0.2, 0.4), (1.0, 0.8, 0.0),
                 (0.6, 0.3, 0.9), (1.0, 0.5, 0.8),
             ])
@@ -388,6 +1170,16 @@ class TreasureHuntEnvironment:
             {'type': 'bridge', 'pos': (10, 10), 'name': 'Wooden Bridge'},
             {'type': 'windmill', 'pos': (-15, -35), 'name': 'Old Windmill'},
         ]
+        
+        # Denser worlds get more villages too, kept clear of the start and landmarks
+        while len(self.houses) < len(house_positions) * self.density:
+            x = self.rng.uniform(-45, 45)
+            z = self.rng.uniform(-85, 45)
+            if math.hypot(x, z + 10) < 8:
+                continue
+            if any(math.hypot(x - lm['pos'][0], z - lm['pos'][1]) < 8 for lm in self.landmarks):
+                continue
+            self.houses.append((x, z, self.rng.choice([(0.8, 0.3, 0.2), (0.7, 0.6, 0.3), (0.5, 0.4, 0.3)])))
     
     def spawn_new_treasure(self):
         self.treasure_found = False
@@ -395,16 +1187,17 @@ class TreasureHuntEnvironment:
         if not available_landmarks:
             self.all_landmarks_used = True
             return
-        landmark = random.choice(available_landmarks)
+        landmark = self.rng.choice(available_landmarks)
         self.used_landmarks.append(landmark)
         self.current_treasure = {
             'landmark': landmark,
             'pos': landmark['pos'],
             'hint': self.generate_hint(landmark)
         }
-        print(f"\nNEW TREASURE HUNT! ({len(self.used_landmarks)}/6)")
-        print(f"Hint: {self.current_treasure['hint']}")
-        print("="*60)
+        if self.verbose:
+            print(f"\nNEW TREASURE HUNT! ({len(self.used_landmarks)}/6)")
+            print(f"Hint: {self.current_treasure['hint']}")
+            print("="*60)
     
     def generate_hint(self, landmark):
         hints = {
@@ -422,21 +1215,35 @@ class TreasureHuntEnvironment:
             return False
         tx, tz = self.current_treasure['pos']
         distance = math.sqrt((fox_pos[0] - tx)**2 + (fox_pos[2] - tz)**2)
-        if distance < 3.0:
+        if distance < TREASURE_RADIUS:
             self.treasure_found = True
-            print("\n" + "="*60)
-            print("TREASURE FOUND!")
-            print(f"You discovered the treasure at {self.current_treasure['landmark']['name']}!")
-            print(f"Progress: {len(self.used_landmarks)}/6 treasures")
-            print("="*60)
-            time.sleep(1)
+            if self.verbose:
+                print("\n" + "="*60)
+                print("TREASURE FOUND!")
+                print(f"You discovered the treasure at {self.current_treasure['landmark']['name']}!")
+                print(f"Progress: {len(self.used_landmarks)}/6 treasures")
+                print("="*60)
             if len(self.used_landmarks) >= len(self.landmarks):
                 self.all_landmarks_used = True
                 return True
-            self.spawn_new_treasure()
+            self.celebration = CELEBRATION_SECONDS
+            self.celebration_pos = (tx, tz)
             return True
         return False
 
+    # Finding a treasure starts a timed celebration instead of blocking; the
+    # next treasure spawns once update() has run it down.
+    def update(self, dt):
+        if self.celebration > 0:
+            self.celebration -= dt
+            if self.celebration <= 0:
+                self.celebration = 0
+                self.spawn_new_treasure()
+
+    @property
+    def celebrating(self):
+        return self.celebration > 0
+
     def draw_cube_helper(self, w, h, d):
         w, h, d = w/2, h/2, d/2
         glBegin(GL_QUADS)
@@ -506,10 +1313,9 @@ class TreasureHuntEnvironment:
         glTranslatef(x, 0, z)
         if ltype == 'well':
             glColor3f(0.5, 0.5, 0.5)
-            quad = gluNewQuadric()
             glPushMatrix()
             glRotatef(-90, 1, 0, 0)
-            gluCylinder(quad, 0.8, 0.8, 1.5, 16, 1)
+            self.geometry.cylinder(0.8, 0.8, 1.5, 16)
             glPopMatrix()
             glColor3f(0.6, 0.3, 0.1)
             glPushMatrix()
@@ -529,8 +1335,7 @@ class TreasureHuntEnvironment:
             glPushMatrix()
             glTranslatef(0, 2, 0)
             glScalef(0.8, 1.5, 0.8)
-            sphere = gluNewQuadric()
-            gluSphere(sphere, 1, 12, 12)
+            self.geometry.sphere(1, 12, 12)
             glPopMatrix()
         elif ltype == 'pond':
             glColor3f(0.2, 0.4, 0.8)
@@ -545,8 +1350,7 @@ class TreasureHuntEnvironment:
             glPushMatrix()
             glTranslatef(0, 1, 0)
             glScalef(2, 1.8, 1.6)
-            sphere = gluNewQuadric()
-            gluSphere(sphere, 1, 10, 10)
+            self.geometry.sphere(1, 10, 10)
             glPopMatrix()
         elif ltype == 'bridge':
             glColor3f(0.5, 0.35, 0.2)
@@ -558,10 +1362,9 @@ class TreasureHuntEnvironment:
                 glPopMatrix()
         elif ltype == 'windmill':
             glColor3f(0.9, 0.9, 0.9)
-            quad = gluNewQuadric()
             glPushMatrix()
             glRotatef(-90, 1, 0, 0)
-            gluCylinder(quad, 0.8, 0.6, 3, 8, 1)
+            self.geometry.cylinder(0.8, 0.6, 3, 8)
             glPopMatrix()
             glColor3f(0.6, 0.4, 0.2)
             glPushMatrix()
@@ -576,53 +1379,74 @@ class TreasureHuntEnvironment:
             glPopMatrix()
         glPopMatrix()
     
-    def draw_tree(self, x, z, size):
-        glPushMatrix()
-        glTranslatef(x, 0, z)
-        glColor3f(0.4, 0.25, 0.1)
+    def draw_tree(self, x, z, size, lod=0):
+        glColor3f(*TREE_TRUNK_COLOR)
+        self.draw_tree_trunk(x, z, size, lod)
+        glColor3f(*TREE_CANOPY_COLOR)
+        self.draw_tree_canopy(x, z, size, lod)
+    
+    def draw_tree_trunk(self, x, z, size, lod=0):
         glPushMatrix()
-        glTranslatef(0, 0.5 * size, 0)
+        glTranslatef(x, 0.5 * size, z)
         glRotatef(-90, 1, 0, 0)
-        quad = gluNewQuadric()
-        gluCylinder(quad, 0.15 * size, 0.12 * size, 1.0 * size, 8, 1)
+        self.geometry.cylinder(0.15 * size, 0.12 * size, 1.0 * size, LOD_TESSELLATION['tree_trunk'][lod])
         glPopMatrix()
-        glColor3f(0.1, 0.5, 0.1)
+    
+    def draw_tree_canopy(self, x, z, size, lod=0):
+        detail = LOD_TESSELLATION['tree_canopy'][lod]
         for i in range(3):
             glPushMatrix()
-            glTranslatef(0, 1.0 * size + i * 0.4 * size, 0)
-            sphere = gluNewQuadric()
-            gluSphere(sphere, 0.6 * size * (1.2 - i * 0.2), 12, 12)
+            glTranslatef(x, 1.0 * size + i * 0.4 * size, z)
+            self.geometry.sphere(0.6 * size * (1.2 - i * 0.2), detail, detail)
             glPopMatrix()
-        glPopMatrix()
     
-    def draw_bush(self, x, z, size):
+    def draw_bush(self, x, z, size, lod=0):
         glPushMatrix()
         glTranslatef(x, 0.3 * size, z)
-        glColor3f(0.15, 0.6, 0.15)
+        glColor3f(*BUSH_COLOR)
         for i in range(3):
             offset_x = (i - 1) * 0.3 * size
             glPushMatrix()
             glTranslatef(offset_x, 0, 0)
-            sphere = gluNewQuadric()
-            gluSphere(sphere, 0.4 * size, 10, 10)
+            detail = LOD_TESSELLATION['bush'][lod]
+            self.geometry.sphere(0.4 * size, detail, detail)
             glPopMatrix()
         glPopMatrix()
     
-    def draw_flower(self, x, z, color):
+    def draw_flower(self, x, z, color, lod=0):
+        glColor3f(*FLOWER_STEM_COLOR)
+        self.draw_flower_stem(x, z, lod)
+        glColor3f(*color)
+        self.draw_flower_head(x, z, lod)
+    
+    def draw_flower_stem(self, x, z, lod=0):
         glPushMatrix()
         glTranslatef(x, 0.0, z)
-        glColor3f(0.1, 0.6, 0.1)
-        glPushMatrix()
         glRotatef(-90, 1, 0, 0)
-        quad = gluNewQuadric()
-        gluCylinder(quad, 0.02, 0.02, 0.3, 4, 1)
+        self.geometry.cylinder(0.02, 0.02, 0.3, LOD_TESSELLATION['flower_stem'][lod])
         glPopMatrix()
-        glTranslatef(0, 0.3, 0)
-        glColor3f(*color)
-        sphere = gluNewQuadric()
-        gluSphere(sphere, 0.08, 6, 6)
+    
+    def draw_flower_head(self, x, z, lod=0):
+        detail = LOD_TESSELLATION['flower_head'][lod]
+        glPushMatrix()
+        glTranslatef(x, 0.3, z)
+        self.geometry.sphere(0.08, detail, detail)
         glPopMatrix()
     
+    def draw_celebration(self):
+        if not self.celebrating:
+            return
+        progress = 1 - self.celebration / CELEBRATION_SECONDS
+        x, z = self.celebration_pos
+        glColor3f(1.0, 0.84, 0.0)
+        for i in range(12):
+            glPushMatrix()
+            glTranslatef(x, 0.5 + progress * 3, z)
+            glRotatef(i * 30 + progress * 360, 0, 1, 0)
+            glTranslatef(0.5 + progress * 2.5, 0, 0)
+            self.geometry.sphere(0.1 * (1 - progress) + 0.03, 6, 6)
+            glPopMatrix()
+    
     def draw_treasure_indicator(self):
         if self.treasure_found or not self.current_treasure or self.all_landmarks_used:
             return
@@ -644,16 +1468,14 @@ class TreasureHuntEnvironment:
         glColor3f(1.0, 0.84, 0.0)
         glPushMatrix()
         glTranslatef(0, 0.0, 0.31)
-        sphere = gluNewQuadric()
-        gluSphere(sphere, 0.08, 8, 8)
+        self.geometry.sphere(0.08, 8, 8)
         glPopMatrix()
         glColor3f(1.0, 1.0, 0.5)
         for i in range(4):
             glPushMatrix()
             glRotatef(i * 90 + time.time() * 100, 0, 1, 0)
             glTranslatef(0.6, 0.5, 0)
-            sphere = gluNewQuadric()
-            gluSphere(sphere, 0.05, 4, 4)
+            self.geometry.sphere(0.05, 4, 4)
             glPopMatrix()
         glPopMatrix()
     
@@ -701,41 +1523,575 @@ class TreasureHuntEnvironment:
             pass
         glPopMatrix()
     
-    def draw(self, fox_pos):
-        self.draw_ground()
-        for x, z, size in self.trees:
-            self.draw_tree(x, z, size)
-        for x, z, size in self.bushes:
-            self.draw_bush(x, z, size)
-        for x, z, color in self.flowers:
-            self.draw_flower(x, z, color)
-        
-        for hx, hz, hcolor in self.houses:
-            self.draw_house(hx, hz, hcolor)
-            dist = math.hypot(fox_pos[0] - hx, fox_pos[2] - hz)
-            if dist < 5.0:
-                self.draw_3d_text("This place looks worth exploring!", hx, 3.5, hz, (0.2, 0.8, 0.2))
-
+    def build_spatial_index(self):
+        grid = SpatialGrid(GRID_CELL_SIZE)
+        for tree in self.trees:
+            grid.insert('trees', tree[0], tree[1], tree)
+        for bush in self.bushes:
+            grid.insert('bushes', bush[0], bush[1], bush)
+        for flower in self.flowers:
+            grid.insert('flowers', flower[0], flower[1], flower)
+        for house in self.houses:
+            grid.insert('houses', house[0], house[1], house)
         for landmark in self.landmarks:
-            self.draw_landmark(landmark)
-        self.draw_treasure_indicator()
-
-
-class BluetoothReceiver:
-    def __init__(self):
-        self.serial_conn = None
-        self.command_queue = queue.Queue()
-        self.running = False
-        self.connected = False
-        self.port = None
-        
-    def find_port(self):
-        ports = serial.tools.list_ports.comports()
-        available_ports = []
-        print("\n" + "="*60)
-        print("Available Serial Ports:")
-        print("="*60)
-        for i, port in enumerate(ports):
+            grid.insert('landmarks', landmark['pos'][0], landmark['pos'][1], landmark)
+        grid.freeze()
+        self.grid = grid
+    
+    def build_colliders(self):
+        colliders = SpatialHash(COLLIDER_CELL_SIZE)
+        for tree in self.trees:
+            colliders.insert('trees', tree[0], tree[1], TREE_COLLIDER * tree[2], item=tree)
+        for bush in self.bushes:
+            colliders.insert('bushes', bush[0], bush[1], BUSH_COLLIDER * bush[2], item=bush)
+        for house in self.houses:
+            colliders.insert('houses', house[0], house[1], HOUSE_HALF_SIZE, square=True, item=house)
+        for landmark in self.landmarks:
+            if landmark['type'] in LANDMARK_COLLIDERS:
+                size, square = LANDMARK_COLLIDERS[landmark['type']]
+                colliders.insert('landmarks', landmark['pos'][0], landmark['pos'][1], size, square, landmark)
+        self.colliders = colliders
+    
+    # Streamed chunks collide from here, not from ChunkStreamer: the 3x3
+    # chunks around the fox are generated on the sim tick from (seed, cx, cz),
+    # so movement depends only on the seed and the fox's path and never on
+    # what the render thread happens to have loaded.
+    def stream_colliders(self, position):
+        if self.world != 'streaming':
+            return
+        key = chunk_of(position[0], position[2])
+        if key == self.collider_chunk:
+            return
+        self.collider_chunk = key
+        for chunk in [c for c in self.collider_chunks if max(abs(c[0] - key[0]), abs(c[1] - key[1])) > 2]:
+            self.colliders.remove(self.collider_chunks.pop(chunk))
+        for dx in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                chunk = (key[0] + dx, key[1] + dz)
+                if chunk in self.collider_chunks or is_home_chunk(chunk):
+                    continue
+                items = generate_chunk(self.seed, chunk[0], chunk[1], self.density)
+                self.collider_chunks[chunk] = (
+                    [self.colliders.insert('trees', tree[0], tree[1], TREE_COLLIDER * tree[2], item=tree)
+                     for tree in items['trees']] +
+                    [self.colliders.insert('bushes', bush[0], bush[1], BUSH_COLLIDER * bush[2], item=bush)
+                     for bush in items['bushes']])
+    
+    # Static scene baking: trees, bushes, flowers, houses, landmarks and the
+    # ground never move after generate_environment(), so each grid cell's
+    # layers are compiled once into display lists grouped by material and
+    # only the cells inside the view frustum are replayed every frame.
+    def bake_static_scene(self):
+        if self.render_mode == 'instanced' and self.instanced is None:
+            if InstancedRenderer.supported():
+                try:
+                    self.upload_vegetation_instances()
+                except RuntimeError as e:
+                    print(f"Instanced rendering unavailable ({e}), using display lists")
+                    self.render_mode = 'baked'
+            else:
+                self.render_mode = 'baked'
+        self.static_lists['ground'] = self.geometry.display_list(('static', id(self), 'ground'), self.draw_ground)
+        layers = STATIC_LAYERS if self.render_mode == 'baked' else ('houses', 'landmarks')
+        self.cell_lists = []
+        for key in self.grid.keys:
+            lod_lists = []
+            for lod in range(len(LOD_DISTANCES) + 1):
+                lists = {}
+                for layer in layers:
+                    items = self.grid.items(key, layer)
+                    if not items:
+                        continue
+                    if layer in ('houses', 'landmarks'):
+                        list_key, build_lod = ('static', id(self), key, layer), 0
+                    else:
+                        list_key, build_lod = ('static', id(self), key, layer, lod), lod
+                    build = lambda layer=layer, items=items, lod=build_lod: self.layer_drawers[layer](items, lod)
+                    lists[layer] = self.geometry.display_list(list_key, build)
+                lod_lists.append(lists)
+            self.cell_lists.append(lod_lists)
+    
+    def invalidate_static_scene(self):
+        for key in [key for key in self.geometry.lists if key[:2] == ('static', id(self))]:
+            self.geometry.delete_list(key)
+        self.static_lists = {}
+        self.cell_lists = []
+        if self.streamer:
+            self.streamer.release()
+        if self.instanced:
+            self.instanced.release()
+            self.instanced = None
+    
+    def vegetation_instances(self):
+        """Per-instance (x, y, z, scale, r, g, b) rows and grid cell ids for each vegetation mesh"""
+        trees = np.array(self.trees, dtype=np.float32).reshape(-1, 3)
+        bushes = np.array(self.bushes, dtype=np.float32).reshape(-1, 3)
+        flowers = np.array([(x, z, *color) for x, z, color in self.flowers], dtype=np.float32).reshape(-1, 5)
+        
+        def rows(x, y, z, scale, color):
+            out = np.empty((len(x), 7), dtype=np.float32)
+            out[:, 0], out[:, 1], out[:, 2], out[:, 3] = x, y, z, scale
+            out[:, 4:] = color
+            return out
+        
+        def cells(items):
+            return np.array([self.grid.index[self.grid.cell_of(item[0], item[1])] for item in items], dtype=np.int64)
+        
+        tx, tz, ts = trees.T
+        bx, bz, bs = bushes.T
+        fx, fz = flowers[:, 0], flowers[:, 1]
+        tree_cells, bush_cells, flower_cells = cells(self.trees), cells(self.bushes), cells(self.flowers)
+        return {
+            'tree_trunk': (rows(tx, 0.5 * ts, tz, ts, TREE_TRUNK_COLOR), tree_cells),
+            'tree_canopy': (np.concatenate([
+                rows(tx, ts + i * 0.4 * ts, tz, 0.6 * ts * (1.2 - i * 0.2), TREE_CANOPY_COLOR) for i in range(3)]),
+                np.tile(tree_cells, 3)),
+            'bush': (np.concatenate([
+                rows(bx + (i - 1) * 0.3 * bs, 0.3 * bs, bz, 0.4 * bs, BUSH_COLOR) for i in range(3)]),
+                np.tile(bush_cells, 3)),
+            'flower_stem': (rows(fx, np.zeros_like(fx), fz, 1.0, FLOWER_STEM_COLOR), flower_cells),
+            'flower_head': (rows(fx, np.full_like(fx, 0.3), fz, 0.08, flowers[:, 2:]), flower_cells),
+        }
+    
+    def upload_vegetation_instances(self):
+        shapes = {
+            'tree_trunk': lambda detail: cylinder_mesh(0.15, 0.12, 1.0, detail),
+            'tree_canopy': lambda detail: sphere_mesh(detail, detail),
+            'bush': lambda detail: sphere_mesh(detail, detail),
+            'flower_stem': lambda detail: cylinder_mesh(0.02, 0.02, 0.3, detail),
+            'flower_head': lambda detail: sphere_mesh(detail, detail),
+        }
+        renderer = InstancedRenderer()
+        for name, (instances, cells) in self.vegetation_instances().items():
+            lod_meshes = [shapes[name](detail) for detail in LOD_TESSELLATION[name]]
+            renderer.upload(name, lod_meshes, instances, cells, len(self.grid.keys))
+        self.instanced = renderer
+    
+    def draw_trees(self, trees, lod=0):
+        glColor3f(*TREE_TRUNK_COLOR)
+        for x, z, size in trees:
+            self.draw_tree_trunk(x, z, size, lod)
+        glColor3f(*TREE_CANOPY_COLOR)
+        for x, z, size in trees:
+            self.draw_tree_canopy(x, z, size, lod)
+    
+    def draw_bushes(self, bushes, lod=0):
+        for x, z, size in bushes:
+            self.draw_bush(x, z, size, lod)
+    
+    def draw_flowers(self, flowers, lod=0):
+        glColor3f(*FLOWER_STEM_COLOR)
+        for x, z, color in flowers:
+            self.draw_flower_stem(x, z, lod)
+        for color in sorted(set(color for _, _, color in flowers)):
+            glColor3f(*color)
+            for x, z, c in flowers:
+                if c == color:
+                    self.draw_flower_head(x, z, lod)
+    
+    def draw_houses(self, houses, lod=0):
+        for hx, hz, hcolor in houses:
+            self.draw_house(hx, hz, hcolor)
+    
+    def draw_landmarks(self, landmarks, lod=0):
+        for landmark in landmarks:
+            self.draw_landmark(landmark)
+    
+    def draw(self, fox_pos):
+        projection, modelview = current_matrices()
+        if self.frustum_culling:
+            visible = self.grid.visible_cells(frustum_planes(projection, modelview))
+        else:
+            visible = np.ones(len(self.grid.keys), dtype=bool)
+        eye = camera_position(modelview)
+        if self.level_of_detail:
+            lods = self.grid.lod_levels(eye)
+        else:
+            lods = np.zeros(len(self.grid.keys), dtype=np.int64)
+        submitted = int(self.grid.counts[visible].sum())
+        self.cull_stats = {'submitted': submitted, 'culled': int(self.grid.counts.sum()) - submitted}
+        
+        # Drawn layer by layer (not cell by cell) so the profiler can time each one
+        section = self.profiler.section
+        cells = np.flatnonzero(visible)
+        if self.render_mode != 'immediate':
+            if not self.static_lists:
+                self.bake_static_scene()
+            with section('ground', gpu=True):
+                glCallList(self.static_lists['ground'])
+            for layer in STATIC_LAYERS:
+                with section(layer, gpu=True):
+                    if self.render_mode == 'instanced' and layer in LAYER_BATCHES:
+                        self.instanced.draw(LAYER_BATCHES[layer], visible, lods)
+                        continue
+                    for cell in cells:
+                        list_id = self.cell_lists[cell][lods[cell]].get(layer)
+                        if list_id:
+                            glCallList(list_id)
+        else:
+            with section('ground', gpu=True):
+                self.draw_ground()
+            for layer in STATIC_LAYERS:
+                with section(layer, gpu=True):
+                    for cell in cells:
+                        items = self.grid.items(self.grid.keys[cell], layer)
+                        if items:
+                            self.layer_drawers[layer](items, lods[cell])
+        
+        if self.world == 'streaming':
+            with section('chunks', gpu=True):
+                if self.streamer is None:
+                    self.streamer = ChunkStreamer(self)
+                self.streamer.update(eye)
+                self.streamer.draw(frustum_planes(projection, modelview) if self.frustum_culling else None,
+                                   eye, self.level_of_detail)
+        
+        with section('markers', gpu=True):
+            for house in self.colliders.query_radius(fox_pos[0], fox_pos[2], HOUSE_LABEL_RADIUS, 'houses'):
+                if math.hypot(fox_pos[0] - house.x, fox_pos[2] - house.z) < HOUSE_LABEL_RADIUS:
+                    self.draw_3d_text("This place looks worth exploring!", house.x, 3.5, house.z, (0.2, 0.8, 0.2))
+            
+            self.draw_treasure_indicator()
+            self.draw_celebration()
+
+
+class InputEvent:
+    """A control command stamped with its monotonic arrival time; frame and
+    presented are filled in when the first frame showing its effect is flipped"""
+    __slots__ = ('command', 'arrival', 'source', 'value', 'frame', 'presented')
+
+    def __init__(self, command, arrival=None, source='bluetooth', value=None):
+        self.command = command
+        self.arrival = time.monotonic() if arrival is None else arrival
+        self.source = source
+        self.value = value
+        self.frame = None
+        self.presented = None
+
+
+MOVEMENT_COMMANDS = ('forward', 'backward', 'left', 'right', 'stop')
+
+
+def coalesce_commands(events):
+    """Collapse a burst of input: only the latest movement command survives,
+    discrete actions (rotate, jump, wave, dance) and axis samples are all
+    kept in order."""
+    actions = []
+    movement = None
+    for event in events:
+        if event.command.lower().strip() in MOVEMENT_COMMANDS:
+            movement = event
+        else:
+            actions.append(event)
+    if movement is not None:
+        actions.append(movement)
+    return actions
+
+
+class LatencyStats:
+    """Input latencies in seconds: a rolling window plus a 1 ms histogram over
+    every sample (the last bin collects anything slower than max_ms)"""
+
+    def __init__(self, window=512, max_ms=250):
+        self.samples = deque(maxlen=window)
+        self.bins = [0] * (max_ms + 1)
+        self.count = 0
+        self.worst = 0.0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.bins[min(int(seconds * 1000), len(self.bins) - 1)] += 1
+        self.count += 1
+        self.worst = max(self.worst, seconds)
+
+    def percentile(self, p):
+        """Upper edge in ms of the histogram bin holding the p-th percentile"""
+        if not self.count:
+            return None
+        target = self.count * p / 100.0
+        seen = 0
+        for ms, n in enumerate(self.bins):
+            seen += n
+            if seen >= target:
+                return ms + 1
+        return len(self.bins)
+
+    def summary(self):
+        if not self.count:
+            return "no samples"
+        mean = sum(self.samples) / len(self.samples) * 1000
+        return (f"{self.count} events, p50 {self.percentile(50)} ms, p95 {self.percentile(95)} ms, "
+                f"p99 {self.percentile(99)} ms, recent mean {mean:.1f} ms, worst {self.worst * 1000:.1f} ms")
+
+    def histogram(self, width=40):
+        """Text histogram of the occupied bins"""
+        peak = max(self.bins)
+        lines = []
+        for ms, n in enumerate(self.bins):
+            if n:
+                label = f">{ms}" if ms == len(self.bins) - 1 else f"{ms}-{ms + 1}"
+                lines.append(f"{label:>9} ms |{'#' * max(1, n * width // peak)} {n}")
+        return "\n".join(lines)
+
+
+# Binary joystick frames: SYNC, opcode, seq, payload, checksum where the
+# checksum is the xor of opcode, seq and payload. Text lines never contain
+# 0xA5 so both protocols can share the link and the decoder tells them apart.
+FRAME_SYNC = 0xA5
+PROTOCOL_HANDSHAKE = b'PROTO BIN\n'
+OP_HELLO = 0x00
+OP_AXIS = 0x01
+FRAME_COMMANDS = {
+    0x10: 'forward',
+    0x11: 'backward',
+    0x12: 'left',
+    0x13: 'right',
+    0x14: 'stop',
+    0x15: 'rotate_left',
+    0x16: 'rotate_right',
+    0x17: 'jump',
+    0x18: 'wave',
+    0x19: 'dance',
+    0x1A: 'reset',
+}
+FRAME_PAYLOAD = dict.fromkeys(FRAME_COMMANDS, 1)
+FRAME_PAYLOAD.update({OP_HELLO: 1, OP_AXIS: 2})
+MAX_TEXT_LINE = 64
+
+
+def encode_frame(opcode, seq, payload=b'\x00'):
+    body = bytes((opcode, seq & 0xFF)) + bytes(payload)
+    checksum = 0
+    for byte in body:
+        checksum ^= byte
+    return bytes((FRAME_SYNC,)) + body + bytes((checksum,))
+
+
+def signed_byte(value):
+    return value - 256 if value > 127 else value
+
+
+def axis_value(raw):
+    """-127..127 axis reading to -1..1 with the dead zone removed"""
+    magnitude = abs(raw) - AXIS_DEADZONE
+    if magnitude <= 0:
+        return 0.0
+    return math.copysign(min(magnitude / (127.0 - AXIS_DEADZONE), 1.0), raw)
+
+
+def parse_text_command(line, arrival):
+    """A text line as an InputEvent; 'axis,x,y' carries analog values like the
+    MPU6050 script's comma-separated lines"""
+    if line.startswith('axis,'):
+        try:
+            _, x, y = line.split(',')
+            return InputEvent('axis', arrival, value=(int(x), int(y)))
+        except ValueError:
+            return None
+    return InputEvent(line, arrival)
+
+
+class FrameDecoder:
+    """Incremental decoder for the joystick link: binary frames and text lines, mixed"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.binary = False
+        self.last_seq = None
+        self.frames = 0
+        self.bad_frames = 0
+        self.dropped_frames = 0
+
+    def feed(self, data, arrival=None):
+        """Append received bytes and return the InputEvents they complete"""
+        if arrival is None:
+            arrival = time.monotonic()
+        buf = self.buffer
+        buf += data
+        events = []
+        i = 0
+        while i < len(buf):
+            if buf[i] == FRAME_SYNC:
+                if len(buf) - i < 2:
+                    break
+                size = FRAME_PAYLOAD.get(buf[i + 1])
+                if size is None:
+                    self.bad_frames += 1
+                    i += 1
+                    continue
+                end = i + 4 + size
+                if len(buf) < end:
+                    break
+                checksum = 0
+                for byte in buf[i + 1:end]:
+                    checksum ^= byte
+                if checksum:
+                    self.bad_frames += 1
+                    i += 1
+                    continue
+                event = self._frame_event(buf[i + 1], buf[i + 2], buf[i + 3:end - 1], arrival)
+                if event:
+                    events.append(event)
+                i = end
+                continue
+            newline = buf.find(b'\n', i)
+            sync = buf.find(FRAME_SYNC, i)
+            if sync != -1 and (newline == -1 or sync < newline):
+                # Partial line cut off by a frame (e.g. across the mode switch)
+                i = sync
+                continue
+            if newline == -1:
+                if len(buf) - i > MAX_TEXT_LINE:
+                    i = len(buf)
+                break
+            command = buf[i:newline].decode('ascii', errors='ignore').strip()
+            event = parse_text_command(command, arrival) if command else None
+            if event:
+                events.append(event)
+            i = newline + 1
+        del buf[:i]
+        return events
+
+    def _frame_event(self, opcode, seq, payload, arrival):
+        self.frames += 1
+        if self.last_seq is not None:
+            self.dropped_frames += (seq - self.last_seq - 1) & 0xFF
+        self.last_seq = seq
+        if opcode == OP_HELLO:
+            self.binary = True
+            return None
+        if opcode == OP_AXIS:
+            return InputEvent('axis', arrival, value=(signed_byte(payload[0]), signed_byte(payload[1])))
+        return InputEvent(FRAME_COMMANDS[opcode], arrival, value=payload[0] / 255.0)
+
+
+class SerialBackend:
+    """Input backend for a real serial port (HC-05/HC-06 over Bluetooth)"""
+
+    def __init__(self, port, baudrate=38400, timeout=0.5):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.conn = None
+
+    @property
+    def name(self):
+        return f"{self.port} at {self.baudrate} baud"
+
+    def open(self):
+        self.conn = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=self.timeout)
+        time.sleep(2)
+
+    def read(self):
+        return self.conn.read(self.conn.in_waiting or 1)
+
+    def write(self, data):
+        self.conn.write(data)
+
+    def close(self):
+        if self.conn and self.conn.is_open:
+            self.conn.close()
+
+
+class PtyBackend:
+    """Virtual serial port on a pseudo-terminal (Linux/macOS). Anything written
+    to `device` (or passed to inject) reaches the receiver as if it came from
+    the joystick, so the input path can be tested without a paired HC-05."""
+
+    def __init__(self, timeout=0.5):
+        self.timeout = timeout
+        self.master = None
+        self.slave = None
+        self.device = None
+
+    @property
+    def name(self):
+        return f"virtual serial port {self.device or '(pty)'}"
+
+    def open(self):
+        import pty
+        import tty
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.device = os.ttyname(self.slave)
+
+    def read(self):
+        ready, _, _ = select.select([self.master], [], [], self.timeout)
+        if not ready:
+            return b''
+        return os.read(self.master, 4096)
+
+    def write(self, data):
+        os.write(self.master, data)
+
+    def inject(self, data):
+        os.write(self.slave, data)
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master = self.slave = None
+
+
+class ReplayBackend:
+    """Plays back a recorded joystick session: one '<seconds> <line>' per line
+    (the headless script format), sent with the original timing"""
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.entries = []
+        self.started = None
+
+    @property
+    def name(self):
+        return f"replay of {self.path}"
+
+    def open(self):
+        self.entries = deque(load_script(self.path))
+        self.started = time.monotonic()
+
+    def read(self):
+        if not self.entries:
+            time.sleep(0.1)
+            return b''
+        seconds, line = self.entries[0]
+        wait = self.started + seconds / self.speed - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, 0.5))
+            return b''
+        data = b''
+        while self.entries and self.entries[0][0] / self.speed <= time.monotonic() - self.started:
+            data += self.entries.popleft()[1].encode('ascii') + b'\n'
+        return data
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        self.entries = deque()
+
+
+class BluetoothReceiver:
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.command_queue = queue.Queue()
+        self.decoder = FrameDecoder()
+        self.running = False
+        self.connected = False
+        self.port = None
+        
+    def find_port(self):
+        ports = serial.tools.list_ports.comports()
+        available_ports = []
+        print("\n" + "="*60)
+        print("Available Serial Ports:")
+        print("="*60)
+        for i, port in enumerate(ports):
             print(f"  [{i}] {port.device} - {port.description}")
             available_ports.append(port.device)
             if 'HC-05' in port.description or 'HC-06' in port.description or 'Bluetooth' in port.description:
@@ -746,120 +2102,662 @@ class BluetoothReceiver:
             return None
         return available_ports
     
-    def connect(self, port=None, baudrate=38400):
-        if port:
-            self.port = port
-        if not self.port:
-            available = self.find_port()
-            if not available:
-                return False
+    # Only asks on the terminal which port to use when interactive is set and
+    # no Bluetooth port was detected; otherwise it never blocks on input().
+    def connect(self, port=None, baudrate=38400, interactive=False):
+        if self.backend is None:
+            if port:
+                self.port = port
             if not self.port:
-                try:
-                    print("\nEnter port number to use (or 'q' to skip): ", end='')
-                    choice = input().strip()
-                    if choice.lower() == 'q':
-                        print("Skipping Bluetooth - keyboard only")
-                        return False
-                    idx = int(choice)
-                    if 0 <= idx < len(available):
-                        self.port = available[idx]
-                except (ValueError, IndexError):
-                    print("Invalid selection")
+                available = self.find_port()
+                if not available:
                     return False
+                if not self.port:
+                    if not interactive:
+                        print("No Bluetooth port detected - keyboard only")
+                        return False
+                    try:
+                        print("\nEnter port number to use (or 'q' to skip): ", end='')
+                        choice = input().strip()
+                        if choice.lower() == 'q':
+                            print("Skipping Bluetooth - keyboard only")
+                            return False
+                        idx = int(choice)
+                        if 0 <= idx < len(available):
+                            self.port = available[idx]
+                    except (ValueError, IndexError, EOFError):
+                        print("Invalid selection")
+                        return False
+            self.backend = SerialBackend(self.port, baudrate)
         try:
-            print(f"\nConnecting to {self.port} at {baudrate} baud...")
-            self.serial_conn = serial.Serial(port=self.port, baudrate=baudrate, timeout=0.1)
-            time.sleep(2)
+            print(f"\nConnecting to {self.backend.name}...")
+            self.backend.open()
             self.connected = True
             print("Bluetooth connected!")
             return True
-        except serial.SerialException as e:
+        except (serial.SerialException, OSError) as e:
             print(f"Connection failed: {e}")
             return False
     
     def start_listening(self):
         if not self.connected:
             return False
+        # Ask the sketch for binary frames; an older sketch ignores this and
+        # keeps sending text lines, which the decoder still understands.
+        try:
+            self.backend.write(PROTOCOL_HANDSHAKE)
+        except (serial.SerialException, OSError):
+            pass
         self.running = True
         listen_thread = threading.Thread(target=self._listen_loop, daemon=True)
         listen_thread.start()
         return True
     
+    # Blocks in read() until at least one byte arrives (or the backend timeout
+    # passes so stop() is noticed), then takes everything already buffered.
+    # Each complete line or frame is queued as an InputEvent stamped on arrival.
     def _listen_loop(self):
         while self.running:
             try:
-                if self.serial_conn and self.serial_conn.in_waiting > 0:
-                    line = self.serial_conn.readline().decode('utf-8').strip()
-                    if line:
-                        self.command_queue.put(line)
-            except serial.SerialException:
+                data = self.backend.read()
+            except (serial.SerialException, OSError, TypeError, AttributeError):
                 self.connected = False
                 break
-            except UnicodeDecodeError:
-                pass
-            time.sleep(0.01)
+            if not data:
+                continue
+            was_binary = self.decoder.binary
+            for event in self.decoder.feed(data, time.monotonic()):
+                self.command_queue.put(event)
+            if self.decoder.binary and not was_binary:
+                print("Joystick switched to binary protocol")
+    
+    @property
+    def protocol(self):
+        return 'binary' if self.decoder.binary else 'text'
     
     def get_command(self):
         try:
-            return self.command_queue.get_nowait()
+            return self.command_queue.get_nowait().command
         except queue.Empty:
             return None
     
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.command_queue.get_nowait())
+            except queue.Empty:
+                return events
+    
     def stop(self):
         self.running = False
-        if self.serial_conn and self.serial_conn.is_open:
-            self.serial_conn.close()
+        if self.backend:
+            self.backend.close()
 
 
-class FoxTreasureHuntGame:
-    def __init__(self):
-        pygame.init()
-        self.display = (1024, 768)
-        self.screen = pygame.display.set_mode(self.display, DOUBLEBUF | OPENGL)
-        pygame.display.set_caption("Fox Treasure Hunt - F = Toggle View")
-        
-        glEnable(GL_DEPTH_TEST)
-        glEnable(GL_LIGHTING)
-        glEnable(GL_LIGHT0)
-        glEnable(GL_COLOR_MATERIAL)
-        glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
-        glClearColor(0.53, 0.81, 0.92, 1.0)
-        
-        glLight(GL_LIGHT0, GL_POSITION, (10, 15, 5, 1))
-        glLight(GL_LIGHT0, GL_AMBIENT, (0.6, 0.6, 0.55, 1))
-        glLight(GL_LIGHT0, GL_DIFFUSE, (1.0, 0.95, 0.8, 1))
-        
+class TextCache:
+    """LRU cache of rendered strings as GL textures keyed by (text, font, colour)"""
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def texture(self, text, font, color):
+        key = (text, font, color)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+        surface = font.render(text, True, color)
+        width, height = surface.get_size()
+        texture_id = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE,
+                     pygame.image.tostring(surface, "RGBA", True))
+        entry = (texture_id, width, height)
+        self.entries[key] = entry
+        if len(self.entries) > self.capacity:
+            _, (old_id, _, _) = self.entries.popitem(last=False)
+            glDeleteTextures([old_id])
+        return entry
+
+    def release(self):
+        if self.entries:
+            glDeleteTextures([texture_id for texture_id, _, _ in self.entries.values()])
+        self.entries.clear()
+
+
+HUD_PANEL_COLOR = (26, 26, 26, 217)
+
+# Fixed-timestep simulation: game logic always advances in SIM_DT steps,
+# independent of the render rate. Frame times above MAX_FRAME_TIME are
+# clamped so a stall cannot trigger an unbounded catch-up burst.
+SIM_HZ = 60
+SIM_DT = 1.0 / SIM_HZ
+MAX_FRAME_TIME = 0.25
+
+
+class RetainedHUD:
+    """Screen-sized HUD texture built from panels that re-render only when their key changes.
+
+    Panels are kept premultiplied and composited in order with the "over"
+    operator, so overlapping panels (the timer box over the hint box) look
+    the same as the old sequence of blended quads.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.panels = []
+        self.texture = None
+        self.rebuilds = 0
+
+    def add_panel(self, name, rect, key, render):
+        self.panels.append({'name': name, 'rect': pygame.Rect(rect), 'key': key, 'render': render,
+                            'last': (None,), 'surface': None})
+
+    def update(self):
+        if self.texture is None:
+            self.texture = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D, self.texture)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, self.size[0], self.size[1], 0, GL_RGBA, GL_UNSIGNED_BYTE,
+                         pygame.image.tostring(self.surface, "RGBA", True))
+        dirty = []
+        for panel in self.panels:
+            key = panel['key']()
+            if key == panel['last']:
+                continue
+            panel['last'] = key
+            surface = pygame.Surface(panel['rect'].size, pygame.SRCALPHA)
+            if key is not None:
+                panel['render'](surface, key)
+            panel['surface'] = surface.premul_alpha()
+            dirty.append(panel['rect'])
+            self.rebuilds += 1
+        if not dirty:
+            return
+        region = dirty[0].unionall(dirty[1:])
+        self.surface.set_clip(region)
+        self.surface.fill((0, 0, 0, 0))
+        for panel in self.panels:
+            if panel['rect'].colliderect(region):
+                self.surface.blit(panel['surface'], panel['rect'], special_flags=BLEND_PREMULTIPLIED)
+        self.surface.set_clip(None)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, region.x, self.size[1] - region.bottom, region.width, region.height,
+                        GL_RGBA, GL_UNSIGNED_BYTE,
+                        pygame.image.tostring(self.surface.subsurface(region), "RGBA", True))
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def draw(self):
+        width, height = self.size
+        glPushAttrib(GL_ENABLE_BIT | GL_CURRENT_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_TEXTURE_2D)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glColor4f(1, 1, 1, 1)
         glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
         glLoadIdentity()
-        gluPerspective(45, (self.display[0] / self.display[1]), 0.1, 100.0)
+        glOrtho(0, width, height, 0, -1, 1)
         glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
         glLoadIdentity()
+        glBegin(GL_QUADS)
+        glTexCoord2f(0, 1); glVertex2f(0, 0)
+        glTexCoord2f(1, 1); glVertex2f(width, 0)
+        glTexCoord2f(1, 0); glVertex2f(width, height)
+        glTexCoord2f(0, 0); glVertex2f(0, height)
+        glEnd()
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glPopAttrib()
+
+    def release(self):
+        if self.texture is not None:
+            glDeleteTextures([self.texture])
+            self.texture = None
+
+
+PROFILE_STAGES = ('events', 'bluetooth', 'movement', 'world', 'timer', 'animation', 'ground',
+                  'trees', 'bushes', 'flowers', 'houses', 'landmarks', 'chunks', 'markers', 'fox', 'hud', 'flip')
+FRAME_BUDGET_MS = 1000.0 / 60
+
+
+class ProfileSection:
+    __slots__ = ('profiler', 'name', 'gpu', 'start')
+
+    def __init__(self, profiler, name, gpu):
+        self.profiler = profiler
+        self.name = name
+        self.gpu = gpu
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        # GL calls only queue work; finishing here bills the GPU time to the
+        # stage that issued it instead of to whatever next blocks (the flip)
+        if self.gpu and self.profiler.sync:
+            glFinish()
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+class NullSection:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SECTION = NullSection()
+
+
+class FrameProfiler:
+    """perf_counter timing of each frame stage, kept as rolling per-stage
+    averages for the overlay and optionally written as one CSV row per frame"""
+
+    def __init__(self, window=120, sync=True):
+        self.enabled = False
+        self.sync = sync
+        self.window = window
+        self.history = {stage: deque(maxlen=window) for stage in PROFILE_STAGES}
+        self.frame_ms = deque(maxlen=window)
+        self.current = {}
+        self.frame_start = None
+        self.frames = 0
+        self.csv_file = None
+
+    @property
+    def active(self):
+        return self.enabled or self.csv_file is not None
+
+    def section(self, name, gpu=False):
+        return ProfileSection(self, name, gpu) if self.active else NULL_SECTION
+
+    def add(self, name, seconds):
+        self.current[name] = self.current.get(name, 0.0) + seconds * 1000
+
+    def begin_frame(self):
+        self.current = {}
+        self.frame_start = time.perf_counter() if self.active else None
+
+    def end_frame(self):
+        if self.frame_start is None:
+            return
+        total = (time.perf_counter() - self.frame_start) * 1000
+        self.frames += 1
+        self.frame_ms.append(total)
+        for stage in PROFILE_STAGES:
+            self.history[stage].append(self.current.get(stage, 0.0))
+        if self.csv_file:
+            self.csv_file.write(f"{self.frames},{total:.3f},"
+                                + ",".join(f"{self.current.get(stage, 0.0):.3f}" for stage in PROFILE_STAGES) + "\n")
+
+    def averages(self):
+        return [(stage, sum(samples) / len(samples)) for stage, samples in self.history.items() if samples]
+
+    def open_csv(self, path):
+        self.csv_file = open(path, 'w')
+        self.csv_file.write("frame,total_ms," + ",".join(f"{stage}_ms" for stage in PROFILE_STAGES) + "\n")
+
+    def close(self):
+        if self.csv_file:
+            self.csv_file.close()
+            self.csv_file = None
+
+
+SESSION_FORMAT = 'fox-session'
+
+
+class SessionRecorder:
+    """Session log: a JSON header line (seed, density, world, tick rate) followed by
+    one '<tick> <command>' line per command fed to the simulation"""
+
+    def __init__(self, path, seed, density=1, world='fixed'):
+        self.path = path
+        self.file = open(path, 'w')
+        self.file.write(json.dumps({'format': SESSION_FORMAT, 'version': 1, 'seed': seed,
+                                    'density': density, 'world': world, 'sim_hz': SIM_HZ}) + '\n')
+        self.commands = 0
+
+    def record(self, tick, command):
+        self.file.write(f"{tick} {command}\n")
+        self.commands += 1
+
+    def close(self, tick):
+        """Mark where the session ended so a replay stops at the same tick"""
+        if not self.file.closed:
+            self.record(tick, 'quit')
+            self.file.close()
+
+
+def load_session(path):
+    """Header dict and (tick, command) list of a SessionRecorder log"""
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get('format') != SESSION_FORMAT:
+            raise ValueError(f"{path} is not a session log")
+        if header['sim_hz'] != SIM_HZ:
+            raise ValueError(f"{path} was recorded at {header['sim_hz']} Hz, game runs at {SIM_HZ} Hz")
+        entries = []
+        for line in f:
+            tick, command = line.rstrip('\n').split(' ', 1)
+            entries.append((int(tick), command))
+    return header, entries
+
+
+# Analog joystick: sketch JOY_DEADZONE rescaled from +-512 to the +-127 axis
+# frames, full deflection gives the keyboard walking speed, sticks that stop
+# streaming for AXIS_HOLD seconds decay to rest with AXIS_RESPONSE smoothing.
+AXIS_DEADZONE = 25
+AXIS_MAX_SPEED = 0.15   # units per tick
+AXIS_TURN_RATE = 4.0    # degrees per tick
+AXIS_HOLD = 0.1
+AXIS_RESPONSE = 0.05
+
+# Replicated per-hunt state, quantised to integers: position in cm, yaw in
+# tenths of a degree, tail phase in milliradians, timer in centiseconds.
+SNAPSHOT_FIELDS = ('x', 'y', 'z', 'yaw', 'flags', 'frame', 'tail', 'treasure', 'found', 'timer', 'state', 'score')
+SNAPSHOT_STATES = ('intro', 'playing', 'won', 'lost')
+SNAPSHOT_FLAGS = ('is_walking', 'is_jumping', 'is_waving', 'is_dancing')
+SNAPSHOT_HEADER = struct.Struct('<cIIHH')
+NO_BASE = 0xFFFFFFFF
+
+
+def quantize_game(game):
+    """One snapshot row for a FoxTreasureHuntGame (its fox and treasure state)"""
+    fox = game.fox
+    env = game.environment
+    treasure = env.current_treasure
+    flags = 0
+    for bit, name in enumerate(SNAPSHOT_FLAGS):
+        if getattr(fox, name):
+            flags |= 1 << bit
+    return (
+        int(round(fox.position[0] * 100)),
+        int(round(fox.position[1] * 100)),
+        int(round(fox.position[2] * 100)),
+        int(round((fox.rotation[1] % 360) * 10)) % 3600,
+        flags,
+        fox.animation_frame,
+        int(round((fox.tail_wave % (2 * math.pi)) * 1000)),
+        env.landmarks.index(treasure['landmark']) if treasure else 255,
+        game.treasures_found,
+        int(round(game.timer * 100)),
+        SNAPSHOT_STATES.index(game.game_state),
+        game.score,
+    )
+
+
+def dequantize_row(row):
+    """Snapshot row back to readable values"""
+    values = dict(zip(SNAPSHOT_FIELDS, (int(v) for v in row)))
+    return {
+        'position': (values['x'] / 100, values['y'] / 100, values['z'] / 100),
+        'yaw': values['yaw'] / 10,
+        **{name: bool(values['flags'] >> bit & 1) for bit, name in enumerate(SNAPSHOT_FLAGS)},
+        'animation_frame': values['frame'],
+        'tail_wave': values['tail'] / 1000,
+        'treasure': None if values['treasure'] == 255 else values['treasure'],
+        'treasures_found': values['found'],
+        'timer': values['timer'] / 100,
+        'state': SNAPSHOT_STATES[values['state']],
+        'score': values['score'],
+    }
+
+
+def encode_varints(values):
+    """Zigzag + LEB128 encode a 1-D int64 array, vectorised"""
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    lengths = np.ones(len(zigzag), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += zigzag >= np.uint64(1 << (7 * k))
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        sel = lengths > k
+        byte = (zigzag[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(lengths[sel] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[sel] + k] = byte
+    return out.tobytes()
+
+
+def decode_varints(data):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not len(buf):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group_start = np.repeat(starts, ends - starts + 1)
+    shifts = ((np.arange(len(buf)) - group_start) * 7).astype(np.uint64)
+    zigzag = np.add.reduceat((buf & 0x7F).astype(np.uint64) << shifts, starts)
+    return (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+
+
+class SnapshotEncoder:
+    """Sender side of snapshot replication for one receiver.
+
+    Each packet is a delta against the newest snapshot the receiver acked
+    (or against zeros when nothing usable is acked): only entities that
+    changed are listed, each with a bitmask of changed fields followed by
+    the zigzag-varint differences, plus the ids of removed entities.
+    """
+
+    def __init__(self, history=64):
+        self.history = OrderedDict()
+        self.capacity = history
+        self.seq = 0
+        self.acked = None
+
+    def ack(self, seq):
+        if seq in self.history and (self.acked is None or seq > self.acked):
+            self.acked = seq
+
+    def encode(self, ids, rows):
+        """ids: entity ids (< 65536); rows: matching quantized rows"""
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids)
+        ids = ids[order]
+        values = np.asarray(rows, dtype=np.int64).reshape(len(ids), len(SNAPSHOT_FIELDS))[order]
+        self.seq += 1
+        base_seq = self.acked if self.acked in self.history else None
+        if base_seq is None:
+            base_ids = np.zeros(0, dtype=np.int64)
+            base_values = np.zeros((0, len(SNAPSHOT_FIELDS)), dtype=np.int64)
+        else:
+            base_ids, base_values = self.history[base_seq]
         
-        self.fox = Fox3D()
-        self.environment = TreasureHuntEnvironment()
-        self.clock = pygame.time.Clock()
+        slot = np.searchsorted(base_ids, ids)
+        known = slot < len(base_ids)
+        known[known] = base_ids[slot[known]] == ids[known]
+        previous = np.zeros_like(values)
+        previous[known] = base_values[slot[known]]
+        delta = values - previous
+        changed = delta != 0
+        masks = (changed * (1 << np.arange(len(SNAPSHOT_FIELDS)))).sum(axis=1)
+        listed = (masks != 0) | ~known
+        removed = np.setdiff1d(base_ids, ids, assume_unique=True)
+        
+        self.history[self.seq] = (ids, values)
+        while len(self.history) > self.capacity:
+            self.history.popitem(last=False)
+        return b''.join((
+            SNAPSHOT_HEADER.pack(b'S', self.seq, NO_BASE if base_seq is None else base_seq,
+                                 int(listed.sum()), len(removed)),
+            ids[listed].astype('<u2').tobytes(),
+            masks[listed].astype('<u2').tobytes(),
+            removed.astype('<u2').tobytes(),
+            encode_varints(delta[listed][changed[listed]]),
+        ))
+
+
+class SnapshotDecoder:
+    """Receiver side: rebuilds full snapshots from deltas; ack the returned seq"""
+
+    def __init__(self, history=64):
+        self.history = OrderedDict()
+        self.capacity = history
+
+    def decode(self, packet):
+        """Returns (seq, ids, rows) with rows as an int64 matrix"""
+        magic, seq, base_seq, listed, removed_count = SNAPSHOT_HEADER.unpack_from(packet)
+        if magic != b'S':
+            raise ValueError("not a snapshot packet")
+        offset = SNAPSHOT_HEADER.size
+        ids = np.frombuffer(packet, '<u2', listed, offset).astype(np.int64)
+        offset += 2 * listed
+        masks = np.frombuffer(packet, '<u2', listed, offset).astype(np.int64)
+        offset += 2 * listed
+        removed = np.frombuffer(packet, '<u2', removed_count, offset).astype(np.int64)
+        offset += 2 * removed_count
+        deltas = decode_varints(packet[offset:])
+        
+        if base_seq == NO_BASE:
+            base_ids = np.zeros(0, dtype=np.int64)
+            base_values = np.zeros((0, len(SNAPSHOT_FIELDS)), dtype=np.int64)
+        elif base_seq in self.history:
+            base_ids, base_values = self.history[base_seq]
+        else:
+            raise KeyError(f"snapshot {seq} is based on {base_seq}, which is no longer held")
+        
+        changed = (masks[:, None] >> np.arange(len(SNAPSHOT_FIELDS))) & 1 == 1
+        keep = ~np.isin(base_ids, removed) & ~np.isin(base_ids, ids)
+        all_ids = np.concatenate((base_ids[keep], ids))
+        previous = np.zeros((listed, len(SNAPSHOT_FIELDS)), dtype=np.int64)
+        slot = np.searchsorted(base_ids, ids)
+        known = slot < len(base_ids)
+        known[known] = base_ids[slot[known]] == ids[known]
+        previous[known] = base_values[slot[known]]
+        previous[changed] += deltas
+        values = np.concatenate((base_values[keep], previous))
+        order = np.argsort(all_ids)
+        
+        self.history[seq] = (all_ids[order], values[order])
+        while len(self.history) > self.capacity:
+            self.history.popitem(last=False)
+        return seq, all_ids[order], values[order]
+
+
+def setup_gl(display):
+    """Fixed-function state and projection shared by the game window and offscreen benchmarks"""
+    glEnable(GL_DEPTH_TEST)
+    glEnable(GL_LIGHTING)
+    glEnable(GL_LIGHT0)
+    glEnable(GL_COLOR_MATERIAL)
+    glEnable(GL_NORMALIZE)
+    glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
+    glClearColor(0.53, 0.81, 0.92, 1.0)
+    
+    glLight(GL_LIGHT0, GL_POSITION, (10, 15, 5, 1))
+    glLight(GL_LIGHT0, GL_AMBIENT, (0.6, 0.6, 0.55, 1))
+    glLight(GL_LIGHT0, GL_DIFFUSE, (1.0, 0.95, 0.8, 1))
+    
+    glMatrixMode(GL_PROJECTION)
+    glLoadIdentity()
+    gluPerspective(45, (display[0] / display[1]), 0.1, 100.0)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+
+
+KEY_COMMANDS = {
+    pygame.K_UP: 'forward',
+    pygame.K_DOWN: 'backward',
+    pygame.K_LEFT: 'left',
+    pygame.K_RIGHT: 'right',
+    pygame.K_SPACE: 'jump',
+    pygame.K_w: 'wave',
+    pygame.K_d: 'dance',
+    pygame.K_q: 'rotate_left',
+    pygame.K_e: 'rotate_right',
+}
+
+
+class FoxTreasureHuntGame:
+    # headless=True runs the same game state machine with no window, GL
+    # context, fonts or Bluetooth, for batch simulation on display-less hosts.
+    def __init__(self, headless=False, verbose=True, input_backend=None, port=None, seed=None, density=1,
+                 world='fixed'):
+        self.headless = headless
+        self.verbose = verbose
+        self.input_backend = input_backend
+        self.port = port
+        self.recorder = None
+        self.replay = None
+        self.profiler = FrameProfiler()
+        self.profiler_lines = []
+        self.display = (1024, 768)
+        
+        self.geometry = GeometryCache()
+        self.fox = Fox3D(self.geometry)
+        self.environment = TreasureHuntEnvironment(self.geometry, density=density, verbose=verbose, seed=seed,
+                                                   world=world)
+        self.environment.profiler = self.profiler
+        self.fox.colliders = self.environment.colliders
         self.running = True
-        self.bt_receiver = BluetoothReceiver()
         
         self.current_direction = None
         self.movement_timeout = 0
-        
-        pygame.font.init()
-        self.font = pygame.font.Font(None, 36)
-        self.small_font = pygame.font.Font(None, 24)
-        self.big_font = pygame.font.Font(None, 48)
+        self.axis_target = (0.0, 0.0)
+        self.axis_velocity = [0.0, 0.0]
+        self.axis_age = 0.0
         
         self.game_state = 'intro'
         self.timer = 120
         self.score = 0
         self.treasures_found = 0
         self.game_over_time = 0
+        self.accumulator = 0.0
+        self.time_scale = 1.0
+        self.ticks = 0
 
         # NEW: Camera mode
         self.front_view = False  # False = Back view, True = Front view
+        
+        if not headless:
+            self.init_display()
+    
+    def init_display(self):
+        pygame.init()
+        self.screen = pygame.display.set_mode(self.display, DOUBLEBUF | OPENGL)
+        pygame.display.set_caption("Fox Treasure Hunt - F = Toggle View")
+        setup_gl(self.display)
+        
+        self.clock = pygame.time.Clock()
+        self.bt_receiver = BluetoothReceiver(self.input_backend)
+        # Input-to-photon latency per source, see present_inputs()
+        self.input_latency = {'bluetooth': LatencyStats(), 'keyboard': LatencyStats()}
+        self.pending_inputs = []   # applied, waiting for a tick to act on them
+        self.ticked_inputs = []    # acted on, waiting for the next flip
+        self.frames_presented = 0
+        self.frame_times = LatencyStats()
+        
+        pygame.font.init()
+        self.font = pygame.font.Font(None, 36)
+        self.small_font = pygame.font.Font(None, 24)
+        self.big_font = pygame.font.Font(None, 48)
+        self.text_cache = TextCache()
+        self.hud = self.build_hud()
 
     def handle_command(self, command):
         command = command.lower().strip()
+        if self.recorder:
+            self.recorder.record(self.ticks, command)
         if command == 'forward':
             self.current_direction = 'forward'
             self.movement_timeout = 60
@@ -888,7 +2786,37 @@ class FoxTreasureHuntGame:
         elif command == 'dance':
             self.fox.is_dancing = not self.fox.is_dancing
     
+    def handle_input(self, event):
+        if event.command == 'axis':
+            self.handle_axis(*event.value)
+        else:
+            self.handle_command(event.command)
+    
+    def handle_axis(self, x, y):
+        """Streamed joystick axes (-127..127), x turns and y drives, mapped to
+        proportional rates like the MPU6050 script maps pitch/roll to speed"""
+        if self.recorder:
+            self.recorder.record(self.ticks, f"axis,{x},{y}")
+        self.axis_target = (axis_value(x), axis_value(y))
+        self.axis_age = 0.0
+    
+    def update_axis(self):
+        self.axis_age += SIM_DT
+        target = self.axis_target if self.axis_age <= AXIS_HOLD else (0.0, 0.0)
+        blend = 1.0 - math.exp(-SIM_DT / AXIS_RESPONSE)
+        for i in range(2):
+            self.axis_velocity[i] += (target[i] - self.axis_velocity[i]) * blend
+            if abs(self.axis_velocity[i]) < 1e-3 and not target[i]:
+                self.axis_velocity[i] = 0.0
+        turn, drive = self.axis_velocity
+        if turn:
+            self.fox.rotation[1] += AXIS_TURN_RATE * turn
+        if drive:
+            self.fox.move_continuous('forward', AXIS_MAX_SPEED * drive)
+        return bool(drive)
+    
     def process_movements(self):
+        self.environment.stream_colliders(self.fox.position)
         if self.movement_timeout > 0:
             self.movement_timeout -= 1
         else:
@@ -899,6 +2827,8 @@ class FoxTreasureHuntGame:
             self.fox.move_continuous(self.current_direction)
         else:
             self.fox.is_walking = False
+        if self.update_axis():
+            self.fox.is_walking = True
         
         if not self.environment.all_landmarks_used:
             if self.environment.check_treasure_proximity(self.fox.position):
@@ -909,36 +2839,164 @@ class FoxTreasureHuntGame:
                 self.fox.is_jumping = True
                 self.fox.animation_frame = 0
 
+    def tick(self):
+        """Advance the game by exactly one SIM_DT step"""
+        if self.replay:
+            self.apply_replay()
+        if not self.running:
+            return
+        self.ticks += 1
+        self.fox.save_previous()
+        # section() hands out the no-op NULL_SECTION while the profiler is off
+        section = self.profiler.section
+        if self.game_state == 'playing':
+            with section('movement'):
+                self.process_movements()
+            with section('world'):
+                self.environment.update(SIM_DT)
+            with section('timer'):
+                self.update_timer()
+        if self.game_state != 'intro':
+            with section('animation'):
+                self.fox.update_animation()
+    
+    def advance(self, seconds):
+        """Run the simulation for the given game time without rendering"""
+        for _ in range(int(round(seconds * SIM_HZ))):
+            self.tick()
+    
     def update_timer(self):
         if self.game_state == 'playing':
-            self.timer -= 1/60
+            if not self.environment.celebrating:
+                self.timer -= SIM_DT
             if self.timer <= 40:
                 self.game_state = 'lost'
                 self.game_over_time = time.time()
-                print("\n" + "="*60)
-                print("40 SECONDS LEFT — TIME'S UP!")
-                print(f"Treasures Found: {self.treasures_found}/6")
-                print(f"Final Score: {self.score}")
-                print("YOU LOSE!")
-                print("="*60)
+                if self.verbose:
+                    print("\n" + "="*60)
+                    print("40 SECONDS LEFT — TIME'S UP!")
+                    print(f"Treasures Found: {self.treasures_found}/6")
+                    print(f"Final Score: {self.score}")
+                    print("YOU LOSE!")
+                    print("="*60)
                 return
             if self.environment.all_landmarks_used:
                 self.game_state = 'won'
                 self.game_over_time = time.time()
-                print("\n" + "="*60)
-                print("VICTORY! ALL TREASURES FOUND!")
-                print(f"Final Score: {self.score}")
-                print("YOU WIN!")
-                print("="*60)
+                if self.verbose:
+                    print("\n" + "="*60)
+                    print("VICTORY! ALL TREASURES FOUND!")
+                    print(f"Final Score: {self.score}")
+                    print("YOU WIN!")
+                    print("="*60)
+
+    def start_game(self):
+        if self.recorder:
+            self.recorder.record(self.ticks, 'start')
+        self.game_state = 'playing'
+        self.accumulator = 0.0
+        if self.verbose:
+            print("\nGAME STARTED! Find all 6 treasures!")
+            print("="*60)
+
+    def run_headless(self, script=(), policy=None, max_seconds=None):
+        """Play one game to won/lost without rendering.
+
+        script is an iterable of (seconds, command) pairs in time order;
+        besides the handle_command vocabulary it accepts 'start' (leave the
+        intro) and 'restart' (play again after won/lost). policy, if given,
+        is called with the game every tick and may return a command. The
+        game starts automatically if the script never sends 'start'.
+        """
+        script = iter(script)
+        pending = next(script, None)
+        limit = None if max_seconds is None else int(max_seconds * SIM_HZ)
+        while True:
+            now = self.ticks * SIM_DT
+            while pending is not None and pending[0] <= now:
+                self.apply_script_command(pending[1])
+                pending = next(script, None)
+            if self.replay:
+                self.apply_replay()
+                if not self.running:
+                    break
+            if self.game_state == 'intro' and (pending is None or pending[1] != 'start') and not self.replay:
+                self.start_game()
+            if policy and self.game_state == 'playing':
+                command = policy(self)
+                if command:
+                    self.handle_command(command)
+            self.tick()
+            if not self.running:
+                break
+            if self.game_state in ('won', 'lost') and pending is None and not self.replay:
+                break
+            if limit is not None and self.ticks >= limit:
+                break
+        return self.result()
+
+    def apply_script_command(self, command):
+        if command == 'start':
+            if self.game_state == 'intro':
+                self.start_game()
+        elif command == 'restart':
+            if self.game_state in ('won', 'lost'):
+                self.reset_game()
+        elif command == 'quit':
+            self.running = False
+        elif self.game_state == 'playing':
+            if command.startswith('axis,'):
+                event = parse_text_command(command, None)
+                if event:
+                    self.handle_input(event)
+            else:
+                self.handle_command(command)
+    
+    def apply_replay(self):
+        """Feed every replayed command due at the current tick"""
+        while self.replay and self.replay[0][0] <= self.ticks:
+            self.apply_script_command(self.replay.popleft()[1])
+    
+    def result(self):
+        return {
+            'state': self.game_state,
+            'treasures': self.treasures_found,
+            'score': self.score,
+            'timer': round(self.timer, 3),
+            'seconds': round(self.ticks * SIM_DT, 3),
+        }
 
     def draw_text_2d(self, text, x, y, font, color=(255, 255, 255)):
-        text_surface = font.render(text, True, color)
-        text_data = pygame.image.tostring(text_surface, "RGBA", True)
+        if not text:
+            return
+        texture_id, width, height = self.text_cache.texture(text, font, color)
+        glPushAttrib(GL_ENABLE_BIT | GL_CURRENT_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_TEXTURE_2D)
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-        glWindowPos2d(x, self.display[1] - y - text_surface.get_height())
-        glDrawPixels(text_surface.get_width(), text_surface.get_height(), GL_RGBA, GL_UNSIGNED_BYTE, text_data)
-        glDisable(GL_BLEND)
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        glColor4f(1, 1, 1, 1)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glOrtho(0, self.display[0], self.display[1], 0, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+        glBegin(GL_QUADS)
+        glTexCoord2f(0, 1); glVertex2f(x, y)
+        glTexCoord2f(1, 1); glVertex2f(x + width, y)
+        glTexCoord2f(1, 0); glVertex2f(x + width, y + height)
+        glTexCoord2f(0, 0); glVertex2f(x, y + height)
+        glEnd()
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glPopAttrib()
     
     def draw_intro_screen(self):
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
@@ -1007,17 +3065,32 @@ class FoxTreasureHuntGame:
         glMatrixMode(GL_MODELVIEW)
         pygame.display.flip()
     
-    def draw_game_over_screen(self):
+    def draw_scene(self, alpha):
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glLoadIdentity()
-        angle_rad = math.radians(self.fox.rotation[1])
+        
+        # CAMERA: Toggle between BACK and FRONT view
+        position = self.fox.render_position(alpha)
+        angle_rad = math.radians(self.fox.render_rotation(alpha)[1])
         cam_dist = 12
-        cam_x = self.fox.position[0] - math.sin(angle_rad) * cam_dist if not self.front_view else self.fox.position[0] + math.sin(angle_rad) * cam_dist
-        cam_z = self.fox.position[2] - math.cos(angle_rad) * cam_dist if not self.front_view else self.fox.position[2] + math.cos(angle_rad) * cam_dist
-        gluLookAt(cam_x, 6, cam_z, self.fox.position[0], self.fox.position[1] + 1, self.fox.position[2], 0, 1, 0)
-        self.environment.draw(self.fox.position)
-        self.fox.update_animation()
-        self.fox.draw()
+        if self.front_view:
+            cam_x = position[0] + math.sin(angle_rad) * cam_dist
+            cam_z = position[2] + math.cos(angle_rad) * cam_dist
+        else:
+            cam_x = position[0] - math.sin(angle_rad) * cam_dist
+            cam_z = position[2] - math.cos(angle_rad) * cam_dist
+        gluLookAt(
+            cam_x, 6, cam_z,
+            position[0], position[1] + 1, position[2],
+            0, 1, 0
+        )
+        
+        self.environment.draw(position)
+        with self.profiler.section('fox', gpu=True):
+            self.fox.draw(alpha)
+    
+    def draw_game_over_screen(self, alpha=1.0):
+        self.draw_scene(alpha)
         glMatrixMode(GL_PROJECTION)
         glPushMatrix()
         glLoadIdentity()
@@ -1051,9 +3124,118 @@ class FoxTreasureHuntGame:
         glPopMatrix()
         glMatrixMode(GL_MODELVIEW)
     
+    # HUD panels are retained: each one re-renders into the HUD texture only
+    # when its key (the inputs it displays) changes, e.g. the timer once a
+    # second and the hint on spawn_new_treasure.
+    def build_hud(self):
+        width, height = self.display
+        hud = RetainedHUD(self.display)
+        hud.add_panel('hint', (10, 10, width - 20, 90), self.hint_panel_key, self.render_hint_panel)
+        hud.add_panel('timer', (width - 220, 10, 210, 110), self.timer_panel_key, self.render_timer_panel)
+        hud.add_panel('progress', (width - 220, 130, 210, 80), self.progress_panel_key, self.render_progress_panel)
+        hud.add_panel('distance', (width - 200, 240, 200, 30), self.distance_panel_key, self.render_label_panel)
+        hud.add_panel('view', (10, height - 40, 400, 30), self.view_panel_key, self.render_label_panel)
+        hud.add_panel('found', (width // 2 - 250, height // 2 - 120, 500, 70), self.found_panel_key,
+                      self.render_found_panel)
+        return hud
+    
+    def hint_panel_key(self):
+        if self.environment.current_treasure:
+            return self.environment.current_treasure['hint']
+        return None
+    
+    def timer_panel_key(self):
+        timer_color = (255, 100, 100) if self.timer < 40 else (255, 215, 0) if self.timer < 60 else (100, 255, 100)
+        return int(self.timer // 60), int(self.timer % 60), timer_color
+    
+    def progress_panel_key(self):
+        return self.treasures_found
+    
+    def distance_panel_key(self):
+        if not self.environment.current_treasure:
+            return None
+        tx, tz = self.environment.current_treasure['pos']
+        distance = math.sqrt((self.fox.position[0] - tx)**2 + (self.fox.position[2] - tz)**2)
+        if distance < 10:
+            return "VERY CLOSE!", (255, 100, 100), self.small_font
+        elif distance < 20:
+            return "Getting warmer...", (255, 200, 100), self.small_font
+        elif distance < 30:
+            return "Keep searching...", (200, 200, 255), self.small_font
+        return "Far away", (150, 150, 150), self.small_font
+    
+    def found_panel_key(self):
+        if self.environment.celebrating:
+            return self.environment.current_treasure['landmark']['name']
+        return None
+    
+    def view_panel_key(self):
+        view_text = "FRONT VIEW" if self.front_view else "BACK VIEW"
+        return f"VIEW: {view_text} (F to toggle)", (255, 255, 100), self.small_font
+    
+    def render_hint_panel(self, area, hint):
+        area.fill(HUD_PANEL_COLOR)
+        pygame.draw.rect(area, (255, 214, 0, 255), area.get_rect(), 2)
+        area.blit(self.font.render("TREASURE HINT:", True, (255, 215, 0)), (15, 20))
+        words = hint.split()
+        line = ""
+        y = 50
+        for word in words:
+            test_line = line + word + " "
+            if len(test_line) > 80:
+                area.blit(self.small_font.render(line, True, (255, 255, 255)), (15, y))
+                line = word + " "
+                y += 25
+            else:
+                line = test_line
+        if line:
+            area.blit(self.small_font.render(line, True, (255, 255, 255)), (15, y))
+    
+    def render_timer_panel(self, area, key):
+        minutes, seconds, timer_color = key
+        area.fill(HUD_PANEL_COLOR)
+        area.blit(self.font.render("TIME:", True, (255, 215, 0)), (20, 20))
+        area.blit(self.big_font.render(f"{minutes}:{seconds:02d}", True, timer_color), (70, 55))
+    
+    def render_progress_panel(self, area, treasures_found):
+        area.fill(HUD_PANEL_COLOR)
+        area.blit(self.font.render("TREASURES:", True, (255, 215, 0)), (20, 20))
+        color = (100, 255, 100) if treasures_found == 6 else (255, 215, 0)
+        area.blit(self.font.render(f"{treasures_found}/6", True, color), (70, 50))
+    
+    def render_found_panel(self, area, name):
+        area.fill(HUD_PANEL_COLOR)
+        pygame.draw.rect(area, (255, 214, 0, 255), area.get_rect(), 2)
+        title = self.big_font.render("TREASURE FOUND!", True, (255, 215, 0))
+        area.blit(title, ((area.get_width() - title.get_width()) // 2, 5))
+        label = self.small_font.render(name, True, (255, 255, 255))
+        area.blit(label, ((area.get_width() - label.get_width()) // 2, 45))
+    
+    def render_label_panel(self, area, key):
+        text, color, font = key
+        # The panel is fully transparent, so copy the glyph alpha as-is
+        area.blit(font.render(text, True, color), (0, 0), special_flags=BLEND_RGBA_MAX)
+    
     def draw_hud(self):
-        glDisable(GL_DEPTH_TEST)
-        glDisable(GL_LIGHTING)
+        self.hud.update()
+        self.hud.draw()
+    
+    def draw_profiler(self):
+        """Overlay with rolling per-stage averages and the recent frame times"""
+        profiler = self.profiler
+        if not profiler.frame_ms:
+            return
+        if profiler.frames % 15 == 0 or not self.profiler_lines:
+            frame_avg = sum(profiler.frame_ms) / len(profiler.frame_ms)
+            self.profiler_lines = [("Frame (P to hide)", f"{frame_avg:.2f} ms", (255, 215, 0))]
+            for stage, ms in profiler.averages():
+                color = (255, 100, 100) if ms > FRAME_BUDGET_MS / 4 else (220, 220, 220)
+                self.profiler_lines.append((stage, f"{ms:.2f} ms", color))
+        x, y, width = 10, 110, 300
+        line_height = 20
+        graph_height = 80
+        height = len(self.profiler_lines) * line_height + graph_height + 20
+        
         glMatrixMode(GL_PROJECTION)
         glPushMatrix()
         glLoadIdentity()
@@ -1061,91 +3243,46 @@ class FoxTreasureHuntGame:
         glMatrixMode(GL_MODELVIEW)
         glPushMatrix()
         glLoadIdentity()
-        if self.environment.current_treasure:
-            glEnable(GL_BLEND)
-            glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-            glColor4f(0.1, 0.1, 0.1, 0.85)
-            glBegin(GL_QUADS)
-            glVertex2f(10, 10)
-            glVertex2f(self.display[0] - 10, 10)
-            glVertex2f(self.display[0] - 10, 100)
-            glVertex2f(10, 100)
-            glEnd()
-            glColor4f(1.0, 0.84, 0.0, 1.0)
-            glLineWidth(2)
-            glBegin(GL_LINE_LOOP)
-            glVertex2f(10, 10)
-            glVertex2f(self.display[0] - 10, 10)
-            glVertex2f(self.display[0] - 10, 100)
-            glVertex2f(10, 100)
-            glEnd()
-            glDisable(GL_BLEND)
-        timer_color = (255, 100, 100) if self.timer < 40 else (255, 215, 0) if self.timer < 60 else (100, 255, 100)
+        glPushAttrib(GL_ENABLE_BIT | GL_CURRENT_BIT | GL_COLOR_BUFFER_BIT)
+        glDisable(GL_DEPTH_TEST)
+        glDisable(GL_LIGHTING)
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-        glColor4f(0.1, 0.1, 0.1, 0.85)
+        glColor4f(0.0, 0.0, 0.0, 0.7)
         glBegin(GL_QUADS)
-        glVertex2f(self.display[0] - 220, 10)
-        glVertex2f(self.display[0] - 10, 10)
-        glVertex2f(self.display[0] - 10, 120)
-        glVertex2f(self.display[0] - 220, 120)
+        glVertex2f(x, y)
+        glVertex2f(x + width, y)
+        glVertex2f(x + width, y + height)
+        glVertex2f(x, y + height)
         glEnd()
-        glDisable(GL_BLEND)
-        glEnable(GL_BLEND)
-        glColor4f(0.1, 0.1, 0.1, 0.85)
-        glBegin(GL_QUADS)
-        glVertex2f(self.display[0] - 220, 130)
-        glVertex2f(self.display[0] - 10, 130)
-        glVertex2f(self.display[0] - 10, 210)
-        glVertex2f(self.display[0] - 220, 210)
+        
+        # Frame-time graph, full height = two frame budgets, with the 60 FPS line
+        base = y + height - 10
+        scale = graph_height / (2 * FRAME_BUDGET_MS)
+        glColor4f(1.0, 0.4, 0.4, 0.8)
+        glBegin(GL_LINES)
+        glVertex2f(x + 10, base - FRAME_BUDGET_MS * scale)
+        glVertex2f(x + width - 10, base - FRAME_BUDGET_MS * scale)
         glEnd()
-        glDisable(GL_BLEND)
+        glColor4f(0.4, 1.0, 0.4, 1.0)
+        glBegin(GL_LINE_STRIP)
+        step = (width - 20) / max(profiler.window - 1, 1)
+        for i, ms in enumerate(profiler.frame_ms):
+            glVertex2f(x + 10 + i * step, base - min(ms, 2 * FRAME_BUDGET_MS) * scale)
+        glEnd()
+        glPopAttrib()
         glPopMatrix()
         glMatrixMode(GL_PROJECTION)
         glPopMatrix()
         glMatrixMode(GL_MODELVIEW)
-        if self.environment.current_treasure:
-            hint = self.environment.current_treasure['hint']
-            self.draw_text_2d("TREASURE HINT:", 25, 30, self.font, (255, 215, 0))
-            words = hint.split()
-            line = ""
-            y = 60
-            for word in words:
-                test_line = line + word + " "
-                if len(test_line) > 80:
-                    self.draw_text_2d(line, 25, y, self.small_font, (255, 255, 255))
-                    line = word + " "
-                    y += 25
-                else:
-                    line = test_line
-            if line:
-                self.draw_text_2d(line, 25, y, self.small_font, (255, 255, 255))
-        minutes = int(self.timer // 60)
-        seconds = int(self.timer % 60)
-        self.draw_text_2d("TIME:", self.display[0] - 200, 30, self.font, (255, 215, 0))
-        self.draw_text_2d(f"{minutes}:{seconds:02d}", self.display[0] - 150, 65, self.big_font, timer_color)
-        progress = f"{self.treasures_found}/6"
-        self.draw_text_2d("TREASURES:", self.display[0] - 200, 150, self.font, (255, 215, 0))
-        self.draw_text_2d(progress, self.display[0] - 150, 180, self.font, 
-                         (100, 255, 100) if self.treasures_found == 6 else (255, 215, 0))
-        if self.environment.current_treasure:
-            tx, tz = self.environment.current_treasure['pos']
-            distance = math.sqrt((self.fox.position[0] - tx)**2 + (self.fox.position[2] - tz)**2)
-            if distance < 10:
-                txt, col = "VERY CLOSE!", (255, 100, 100)
-            elif distance < 20:
-                txt, col = "Getting warmer...", (255, 200, 100)
-            elif distance < 30:
-                txt, col = "Keep searching...", (200, 200, 255)
-            else:
-                txt, col = "Far away", (150, 150, 150)
-            self.draw_text_2d(txt, self.display[0] - 200, 240, self.small_font, col)
-        view_text = "FRONT VIEW" if self.front_view else "BACK VIEW"
-        self.draw_text_2d(f"VIEW: {view_text} (F to toggle)", 10, self.display[1] - 40, self.small_font, (255, 255, 100))
-        glEnable(GL_DEPTH_TEST)
-        glEnable(GL_LIGHTING)
+        
+        for i, (label, value, color) in enumerate(self.profiler_lines):
+            self.draw_text_2d(label, x + 10, y + 8 + i * line_height, self.small_font, color)
+            self.draw_text_2d(value, x + 200, y + 8 + i * line_height, self.small_font, color)
     
     def reset_game(self):
+        if self.recorder:
+            self.recorder.record(self.ticks, 'restart')
         self.fox.position = [0, 0, -10]
         self.fox.rotation = [0, 0, 0]
         self.fox.is_walking = False
@@ -1153,6 +3290,7 @@ class FoxTreasureHuntGame:
         self.fox.is_waving = False
         self.environment.used_landmarks = []
         self.environment.all_landmarks_used = False
+        self.environment.celebration = 0
         self.environment.spawn_new_treasure()
         self.timer = 120
         self.score = 0
@@ -1160,20 +3298,67 @@ class FoxTreasureHuntGame:
         self.game_state = 'playing'
         self.current_direction = None
         self.movement_timeout = 0
+        self.axis_target = (0.0, 0.0)
+        self.axis_velocity = [0.0, 0.0]
+        self.axis_age = 0.0
+        self.accumulator = 0.0
+        self.fox.save_previous()
         self.front_view = False  # Reset to back view
     
+    def apply_input(self, event):
+        self.handle_input(event)
+        self.pending_inputs.append(event)
+    
+    def present_inputs(self):
+        """Called right after flip: every input a tick has acted on since the
+        last flip is now on screen, so stamp it with this frame and record its
+        latency. Inputs still waiting for a tick wait for a later frame."""
+        self.frames_presented += 1
+        if not self.ticked_inputs:
+            return
+        presented = time.monotonic()
+        for event in self.ticked_inputs:
+            event.frame = self.frames_presented
+            event.presented = presented
+            self.input_latency[event.source].record(presented - event.arrival)
+        self.ticked_inputs = []
+    
+    def print_latency_report(self):
+        for source, stats in self.input_latency.items():
+            if stats.count:
+                print(f"\n{source.capitalize()} input-to-frame latency: {stats.summary()}")
+                print(stats.histogram())
+    
     def run(self):
         print("\n" + "="*60)
         print("FOX TREASURE HUNT - F = TOGGLE FRONT/BACK VIEW")
         print("="*60)
-        if self.bt_receiver.connect():
+        if self.replay is not None:
+            print(f"\nReplaying {len(self.replay)} recorded commands (seed {self.environment.seed})")
+        elif self.bt_receiver.connect(self.port, interactive=sys.stdin.isatty()):
             self.bt_receiver.start_listening()
             print("\nBluetooth active!")
         else:
             print("\nKeyboard only")
         print("\n" + "="*60)
+        live = self.replay is None
         
+        # Replays run uncapped so their frame times measure the machine
         while self.running:
+            frame_time = min(self.clock.tick(60 if live else 0) / 1000.0, MAX_FRAME_TIME)
+            self.profiler.begin_frame()
+            if not live:
+                self.frame_times.record(frame_time)
+                self.apply_replay()
+                if not self.running:
+                    break
+            
+            if self.game_state != 'playing':
+                # Only 'playing' consumes controller commands; drop the rest so
+                # they don't fire, or count as latency samples, after a start
+                self.bt_receiver.drain()
+                self.pending_inputs = []
+            
             if self.game_state == 'intro':
                 self.draw_intro_screen()
                 for event in pygame.event.get():
@@ -1182,97 +3367,605 @@ class FoxTreasureHuntGame:
                     elif event.type == pygame.KEYDOWN:
                         if event.key == pygame.K_ESCAPE:
                             self.running = False
-                        elif event.key in [pygame.K_RETURN, pygame.K_SPACE]:
-                            self.game_state = 'playing'
-                            print("\nGAME STARTED! Find all 6 treasures!")
-                            print("="*60)
-                self.clock.tick(60)
+                        elif event.key in [pygame.K_RETURN, pygame.K_SPACE] and live:
+                            self.start_game()
                 continue
             
             if self.game_state in ['won', 'lost']:
-                self.draw_game_over_screen()
+                self.accumulator += frame_time * self.time_scale
+                while self.accumulator >= SIM_DT:
+                    self.tick()
+                    self.accumulator -= SIM_DT
+                self.draw_game_over_screen(min(self.accumulator / SIM_DT, 1.0))
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         self.running = False
                     elif event.type == pygame.KEYDOWN:
                         if event.key == pygame.K_ESCAPE:
                             self.running = False
-                        elif event.key == pygame.K_RETURN:
+                        elif event.key == pygame.K_RETURN and live:
                             self.reset_game()
                 pygame.display.flip()
-                self.clock.tick(60)
                 continue
             
+            events_started = time.perf_counter()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
                         self.running = False
+                    elif event.key == pygame.K_p:
+                        self.profiler.enabled = not self.profiler.enabled
+                        self.profiler_lines = []
                     elif event.key == pygame.K_f:
                         self.front_view = not self.front_view
                         print(f"Camera switched to {'FRONT' if self.front_view else 'BACK'} view!")
-                    elif event.key == pygame.K_UP:
-                        self.handle_command('forward')
-                    elif event.key == pygame.K_DOWN:
-                        self.handle_command('backward')
-                    elif event.key == pygame.K_LEFT:
-                        self.handle_command('left')
-                    elif event.key == pygame.K_RIGHT:
-                        self.handle_command('right')
-                    elif event.key == pygame.K_SPACE:
-                        self.handle_command('jump')
-                    elif event.key == pygame.K_w:
-                        self.handle_command('wave')
-                    elif event.key == pygame.K_d:
-                        self.handle_command('dance')
-                    elif event.key == pygame.K_q:
-                        self.handle_command('rotate_left')
-                    elif event.key == pygame.K_e:
-                        self.handle_command('rotate_right')
-                elif event.type == pygame.KEYUP:
+                    elif event.key == pygame.K_l:
+                        self.print_latency_report()
+                    elif event.key in KEY_COMMANDS and live:
+                        self.apply_input(InputEvent(KEY_COMMANDS[event.key], source='keyboard'))
+                elif event.type == pygame.KEYUP and live:
                     if event.key in [pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT]:
-                        self.handle_command('stop')
-            
-            command = self.bt_receiver.get_command()
-            if command:
-                self.handle_command(command)
+                        self.apply_input(InputEvent('stop', source='keyboard'))
             
-            self.process_movements()
-            self.update_timer()
+            self.profiler.add('events', time.perf_counter() - events_started)
             
-            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-            glLoadIdentity()
+            with self.profiler.section('bluetooth'):
+                bt_events = self.bt_receiver.drain()
+                for event in coalesce_commands(bt_events):
+                    self.handle_input(event)
+                self.pending_inputs.extend(bt_events)
             
-            # CAMERA: Toggle between BACK and FRONT view
-            angle_rad = math.radians(self.fox.rotation[1])
-            cam_dist = 12
-            if self.front_view:
-                cam_x = self.fox.position[0] + math.sin(angle_rad) * cam_dist
-                cam_z = self.fox.position[2] + math.cos(angle_rad) * cam_dist
-            else:
-                cam_x = self.fox.position[0] - math.sin(angle_rad) * cam_dist
-                cam_z = self.fox.position[2] - math.cos(angle_rad) * cam_dist
-            gluLookAt(
-                cam_x, 6, cam_z,
-                self.fox.position[0], self.fox.position[1] + 1, self.fox.position[2],
-                0, 1, 0
-            )
+            self.accumulator += frame_time * self.time_scale
+            while self.accumulator >= SIM_DT and self.game_state == 'playing':
+                self.tick()
+                self.accumulator -= SIM_DT
+                if self.pending_inputs:
+                    self.ticked_inputs.extend(self.pending_inputs)
+                    self.pending_inputs = []
             
-            self.environment.draw(self.fox.position)
-            self.fox.update_animation()
-            self.fox.draw()
-            self.draw_hud()
-            pygame.display.flip()
-            self.clock.tick(60)
+            self.draw_scene(min(self.accumulator / SIM_DT, 1.0))
+            with self.profiler.section('hud', gpu=True):
+                self.draw_hud()
+            if self.profiler.enabled:
+                self.draw_profiler()
+            with self.profiler.section('flip'):
+                pygame.display.flip()
+            self.profiler.end_frame()
+            self.present_inputs()
         
         self.bt_receiver.stop()
+        self.print_latency_report()
+        self.profiler.close()
+        if self.recorder:
+            self.recorder.close(self.ticks)
+            print(f"Session recorded to {self.recorder.path} ({self.recorder.commands} commands)")
+        if not live:
+            print(f"Replay result: {self.result()}")
+            print(f"Replay frame times: {self.frame_times.summary()}")
+        print(f"Live GLU quadrics at exit: {self.geometry.live_quadrics}")
+        if self.environment.streamer:
+            self.environment.streamer.stop()
+        self.environment.invalidate_static_scene()
+        self.text_cache.release()
+        self.hud.release()
+        self.geometry.release()
         pygame.quit()
 
 
+# Swarm command codes; index 0 means no command this tick
+SWARM_COMMANDS = ('none', 'forward', 'backward', 'left', 'right', 'stop', 'rotate_left', 'rotate_right')
+# Per movement direction, the (sin, cos) coefficients of the x and z steps
+# in Fox3D.move_continuous
+SWARM_STEP_X = np.array([(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.float64)
+SWARM_STEP_Z = np.array([(0, 0), (0, -1), (0, 1), (1, 0), (-1, 0)], dtype=np.float64)
+SWARM_STATES = ('playing', 'won', 'lost')
+
+
+def collider_distance(packed, index, x, z):
+    """Collider.distance over arrays of SpatialHash.pack() collider indices"""
+    dx, dz = x - packed['x'][index], z - packed['z'][index]
+    size = packed['size'][index]
+    square = np.hypot(np.maximum(np.abs(dx) - size, 0.0), np.maximum(np.abs(dz) - size, 0.0))
+    return np.where(packed['square'][index], square, np.maximum(np.hypot(dx, dz) - size, 0.0))
+
+
+def collider_push(packed, index, x, z, radius):
+    """Collider.push over arrays"""
+    cx, cz, size = packed['x'][index], packed['z'][index], packed['size'][index]
+    dx, dz = x - cx, z - cz
+    # Circles
+    d = np.hypot(dx, dz)
+    scale = (size + radius) / np.where(d > 0, d, 1.0)
+    circle_x = np.where(d > 0, cx + dx * scale, x)
+    circle_z = np.where(d > 0, cz + dz * scale, cz + size + radius)
+    circle_over = d < size + radius
+    # Squares
+    ex, ez = np.maximum(np.abs(dx) - size, 0.0), np.maximum(np.abs(dz) - size, 0.0)
+    d = np.hypot(ex, ez)
+    scale = radius / np.where(d > 0, d, 1.0)
+    through_x = size - np.abs(dx) < size - np.abs(dz)
+    square_x = np.where(d > 0, x + np.copysign(ex * scale - ex, dx),
+                        np.where(through_x, cx + np.copysign(size + radius, dx), x))
+    square_z = np.where(d > 0, z + np.copysign(ez * scale - ez, dz),
+                        np.where(through_x, z, cz + np.copysign(size + radius, dz)))
+    square_over = d < radius
+    square = packed['square'][index]
+    over = np.where(square, square_over, circle_over)
+    return (np.where(over, np.where(square, square_x, circle_x), x),
+            np.where(over, np.where(square, square_z, circle_z), z))
+
+
+class FoxSwarm:
+    """N bot foxes hunting in one shared world, advanced together with numpy.
+
+    Follows the per-fox rules of FoxTreasureHuntGame (commands with their
+    movement timeout, analog axes, treasure radius, celebration, timer and
+    score) with every fox in a row of the state arrays; each fox draws its
+    own treasure order. Animation is left out. For AI training and balance
+    runs where thousands of headless games would be too slow.
+    """
+
+    def __init__(self, environment, count, seed=None):
+        self.environment = environment
+        self.count = count
+        self.rng = np.random.default_rng(seed)
+        self.landmarks = np.array([lm['pos'] for lm in environment.landmarks], dtype=np.float64)
+        self.houses = np.array([(x, z) for x, z, _ in environment.houses], dtype=np.float64).reshape(-1, 2)
+        self.collision = environment.colliders.pack(FOX_RADIUS)
+        self.position = np.zeros((count, 3))
+        self.yaw = np.zeros(count)
+        self.direction = np.zeros(count, dtype=np.int8)
+        self.movement_timeout = np.zeros(count, dtype=np.int16)
+        self.axis_target = np.zeros((count, 2))
+        self.axis_velocity = np.zeros((count, 2))
+        self.axis_age = np.zeros(count)
+        self.walking = np.zeros(count, dtype=bool)
+        self.used = np.zeros((count, len(self.landmarks)), dtype=bool)
+        self.treasure = np.zeros(count, dtype=np.int64)
+        self.treasure_found = np.zeros(count, dtype=bool)
+        self.all_used = np.zeros(count, dtype=bool)
+        self.celebration = np.zeros(count)
+        self.treasures_found = np.zeros(count, dtype=np.int64)
+        self.score = np.zeros(count, dtype=np.int64)
+        self.timer = np.zeros(count)
+        self.state = np.zeros(count, dtype=np.int8)
+        self.ticks = 0
+        self.reset(np.arange(count))
+
+    def reset(self, foxes):
+        """Start (or restart) the given foxes at the spawn point with a fresh hunt"""
+        self.position[foxes] = (0, 0, -10)
+        self.yaw[foxes] = 0
+        self.direction[foxes] = 0
+        self.movement_timeout[foxes] = 0
+        self.axis_target[foxes] = 0
+        self.axis_velocity[foxes] = 0
+        self.axis_age[foxes] = 0
+        self.used[foxes] = False
+        self.all_used[foxes] = False
+        self.celebration[foxes] = 0
+        self.treasures_found[foxes] = 0
+        self.score[foxes] = 0
+        self.timer[foxes] = 120
+        self.state[foxes] = 0
+        self.spawn_treasures(np.asarray(foxes))
+
+    def spawn_treasures(self, foxes):
+        """Pick each fox's next treasure uniformly among its unused landmarks"""
+        if foxes.dtype == bool:
+            foxes = np.flatnonzero(foxes)
+        self.treasure_found[foxes] = False
+        keys = self.rng.random((len(foxes), len(self.landmarks)))
+        keys[self.used[foxes]] = -1
+        choice = keys.argmax(axis=1)
+        exhausted = keys.max(axis=1) < 0
+        self.all_used[foxes[exhausted]] = True
+        chosen = foxes[~exhausted]
+        self.treasure[chosen] = choice[~exhausted]
+        self.used[chosen, choice[~exhausted]] = True
+
+    def command(self, codes):
+        """Apply one SWARM_COMMANDS code per fox, as handle_command would"""
+        codes = np.asarray(codes)
+        playing = self.state == 0
+        moving = playing & (codes >= 1) & (codes <= 4)
+        self.direction[moving] = codes[moving]
+        self.movement_timeout[moving] = 60
+        stop = playing & (codes == 5)
+        self.direction[stop] = 0
+        self.movement_timeout[stop] = 0
+        self.yaw[playing & (codes == 6)] -= 15
+        self.yaw[playing & (codes == 7)] += 15
+
+    def axis(self, foxes, x, y):
+        """Raw joystick axes (-127..127) for some foxes, as handle_axis"""
+        raw = np.stack([np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)], axis=-1)
+        value = np.sign(raw) * np.clip((np.abs(raw) - AXIS_DEADZONE) / (127.0 - AXIS_DEADZONE), 0.0, 1.0)
+        playing = self.state[foxes] == 0
+        foxes = np.asarray(foxes)[playing]
+        self.axis_target[foxes] = value[playing]
+        self.axis_age[foxes] = 0.0
+
+    def step(self):
+        """One SIM_DT tick for every fox, in the order of FoxTreasureHuntGame.tick"""
+        self.ticks += 1
+        playing = self.state == 0
+        # process_movements: commanded direction, then axes
+        expired = self.movement_timeout <= 0
+        self.direction[playing & expired] = 0
+        self.movement_timeout[playing & ~expired] -= 1
+        direction = np.where(playing, self.direction, 0)
+        angle = np.radians(self.yaw)
+        sin, cos = np.sin(angle), np.cos(angle)
+        speed = 0.15
+        self.position[:, 0] += (SWARM_STEP_X[direction, 0] * sin + SWARM_STEP_X[direction, 1] * cos) * speed
+        self.position[:, 2] += (SWARM_STEP_Z[direction, 0] * sin + SWARM_STEP_Z[direction, 1] * cos) * speed
+        self.collide(direction != 0)
+
+        self.axis_age[playing] += SIM_DT
+        target = np.where((self.axis_age <= AXIS_HOLD)[:, None], self.axis_target, 0.0)
+        velocity = self.axis_velocity
+        velocity += (target - velocity) * (1.0 - math.exp(-SIM_DT / AXIS_RESPONSE)) * playing[:, None]
+        velocity[(np.abs(velocity) < 1e-3) & (target == 0)] = 0.0
+        turn, drive = np.where(playing[:, None], velocity, 0.0).T
+        self.yaw += AXIS_TURN_RATE * turn
+        angle = np.radians(self.yaw)
+        self.position[:, 0] -= np.sin(angle) * AXIS_MAX_SPEED * drive
+        self.position[:, 2] -= np.cos(angle) * AXIS_MAX_SPEED * drive
+        self.collide(drive != 0)
+        self.walking = np.where(playing, (direction != 0) | (drive != 0), self.walking)
+
+        # check_treasure_proximity
+        hunting = playing & ~self.treasure_found & ~self.all_used
+        target = self.landmarks[self.treasure]
+        distance = np.hypot(self.position[:, 0] - target[:, 0], self.position[:, 2] - target[:, 1])
+        found = hunting & (distance < TREASURE_RADIUS)
+        self.treasure_found |= found
+        last = found & self.used.all(axis=1)
+        self.all_used |= last
+        self.celebration[found & ~last] = CELEBRATION_SECONDS
+        self.treasures_found += found
+        self.score += np.where(found, (self.timer * 10).astype(np.int64), 0)
+        self.timer[found] = 120
+
+        # environment.update: celebrations run down, then the next treasure spawns
+        celebrating = playing & (self.celebration > 0)
+        self.celebration[celebrating] -= SIM_DT
+        done = celebrating & (self.celebration <= 0)
+        self.celebration[done] = 0
+        if done.any():
+            self.spawn_treasures(done)
+
+        # update_timer
+        self.timer[playing & (self.celebration <= 0)] -= SIM_DT
+        lost = playing & (self.timer <= 40)
+        self.state[lost] = SWARM_STATES.index('lost')
+        self.state[playing & ~lost & self.all_used] = SWARM_STATES.index('won')
+        return found
+
+    def collide(self, moved):
+        """SpatialHash.resolve for every fox in the moved mask"""
+        foxes = np.flatnonzero(moved)
+        if not len(foxes) or not len(self.collision['x']):
+            return
+        c = self.collision
+        table = c['table']
+        x, z = self.position[foxes, 0], self.position[foxes, 2]
+        for _ in range(2):
+            cell_x = np.floor(x / c['cell_size']).astype(np.int64) - c['origin'][0]
+            cell_z = np.floor(z / c['cell_size']).astype(np.int64) - c['origin'][1]
+            inside = (cell_x >= 0) & (cell_x < table.shape[0]) & (cell_z >= 0) & (cell_z < table.shape[1])
+            rows = np.flatnonzero(inside)
+            candidates = table[cell_x[rows], cell_z[rows]]
+            pair_rows, slots = np.nonzero(candidates >= 0)
+            index = candidates[pair_rows, slots]
+            rows = rows[pair_rows]
+            hits = collider_distance(c, index, x[rows], z[rows]) < FOX_RADIUS
+            if not hits.any():
+                break
+            rows, slots, index = rows[hits], slots[hits], index[hits]
+            # Same order as the scalar path: each fox's colliders by bucket slot
+            for slot in np.unique(slots):
+                sel = slots == slot
+                fox = rows[sel]
+                x[fox], z[fox] = collider_push(c, index[sel], x[fox], z[fox], FOX_RADIUS)
+        self.position[foxes, 0] = x
+        self.position[foxes, 2] = z
+
+    def near_houses(self, radius=HOUSE_LABEL_RADIUS, block=4096):
+        """Index of the nearest house within radius of each fox, or -1"""
+        nearest = np.full(self.count, -1, dtype=np.int64)
+        if not len(self.houses):
+            return nearest
+        for start in range(0, self.count, block):
+            xz = self.position[start:start + block][:, [0, 2]]
+            d2 = ((xz[:, None, :] - self.houses[None, :, :]) ** 2).sum(axis=2)
+            closest = d2.argmin(axis=1)
+            within = d2[np.arange(len(xz)), closest] < radius * radius
+            nearest[start:start + block] = np.where(within, closest, -1)
+        return nearest
+
+    def autopilot(self, every=6):
+        """Vectorised autopilot(): steer toward each fox's treasure every few ticks"""
+        codes = np.zeros(self.count, dtype=np.int8)
+        if self.ticks % every:
+            return codes
+        target = self.landmarks[self.treasure]
+        heading = np.degrees(np.arctan2(-(target[:, 0] - self.position[:, 0]), -(target[:, 1] - self.position[:, 2])))
+        error = (heading - self.yaw + 180) % 360 - 180
+        codes[:] = SWARM_COMMANDS.index('forward')
+        codes[error > 10] = SWARM_COMMANDS.index('rotate_right')
+        codes[error < -10] = SWARM_COMMANDS.index('rotate_left')
+        codes[(self.state != 0) | self.all_used] = 0
+        return codes
+
+
+def load_script(path):
+    """Read a headless command script: one '<seconds> <command>' per line, '#' comments"""
+    script = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                seconds, command = line.split(None, 1)
+                script.append((float(seconds), command.strip()))
+    return sorted(script, key=lambda entry: entry[0])
+
+
+def autopilot(game, every=6):
+    """Simple seek-the-treasure bot policy for run_headless (acts every few ticks like a joystick)"""
+    if game.ticks % every or not game.environment.current_treasure:
+        return None
+    tx, tz = game.environment.current_treasure['pos']
+    dx, dz = tx - game.fox.position[0], tz - game.fox.position[2]
+    heading = math.degrees(math.atan2(-dx, -dz))
+    error = (heading - game.fox.rotation[1] + 180) % 360 - 180
+    if error > 10:
+        return 'rotate_right'
+    if error < -10:
+        return 'rotate_left'
+    return 'forward'
+
+
+def run_batch(games, script=(), policy=None, seed=None, record=None):
+    results = []
+    started = time.perf_counter()
+    for i in range(games):
+        game = FoxTreasureHuntGame(headless=True, verbose=False, seed=None if seed is None else seed + i)
+        if record:
+            path = record if games == 1 else f"{record}.{i}"
+            game.recorder = SessionRecorder(path, game.environment.seed, game.environment.density)
+        results.append(game.run_headless(script, policy))
+        if record:
+            game.recorder.close(game.ticks)
+    elapsed = time.perf_counter() - started
+    wins = sum(1 for result in results if result['state'] == 'won')
+    print("="*60)
+    print(f"HEADLESS BATCH: {games} games in {elapsed:.2f}s ({games / elapsed * 60:.0f} games/min)")
+    print(f"Wins: {wins}/{games} | Avg treasures: {sum(r['treasures'] for r in results) / games:.2f}"
+          f" | Avg score: {sum(r['score'] for r in results) / games:.0f}")
+    print("="*60)
+    return results
+
+
+def benchmark_input(rate=1000, seconds=5.0, protocol='binary'):
+    """Push synthetic joystick traffic through a PtyBackend and the real
+    receiver -> queue -> coalesce -> handle_input path of a headless game
+    paced at 60 frames/s, then report throughput and latency"""
+    backend = PtyBackend()
+    receiver = BluetoothReceiver(backend)
+    receiver.connect()
+    receiver.start_listening()
+    game = FoxTreasureHuntGame(headless=True, verbose=False)
+    game.start_game()
+    latency = LatencyStats()
+    
+    def send():
+        period = 1.0 / rate
+        start = time.monotonic()
+        for i in range(int(rate * seconds)):
+            x, y = int(127 * math.sin(i * 0.01)), int(127 * math.cos(i * 0.013))
+            if protocol == 'binary':
+                backend.inject(encode_frame(OP_AXIS, i, bytes((x & 0xFF, y & 0xFF))))
+            else:
+                backend.inject(f"axis,{x},{y}\n".encode('ascii'))
+            wait = start + (i + 1) * period - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+    
+    sender = threading.Thread(target=send, daemon=True)
+    started = time.monotonic()
+    sender.start()
+    received = frames = 0
+    next_frame = started
+    while sender.is_alive() or not receiver.command_queue.empty():
+        events = receiver.drain()
+        for event in coalesce_commands(events):
+            game.handle_input(event)
+        game.tick()
+        now = time.monotonic()
+        for event in events:
+            latency.record(now - event.arrival)
+        received += len(events)
+        frames += 1
+        next_frame += 1.0 / 60
+        time.sleep(max(0.0, next_frame - time.monotonic()))
+    elapsed = time.monotonic() - started
+    receiver.stop()
+    sent = int(rate * seconds)
+    print("="*60)
+    print(f"INPUT BENCHMARK ({protocol}, {rate}/s for {seconds:g}s over {backend.device})")
+    print(f"Received {received}/{sent} events in {elapsed:.2f}s ({received / elapsed:.0f} events/s, {frames} frames)")
+    print(f"Bad frames: {receiver.decoder.bad_frames} | Dropped frames: {receiver.decoder.dropped_frames}")
+    print(f"Arrival-to-handled latency: {latency.summary()}")
+    print("="*60)
+    return {'sent': sent, 'received': received, 'elapsed': elapsed,
+            'p50_ms': latency.percentile(50), 'p99_ms': latency.percentile(99)}
+
+
+def benchmark_snapshots(entities=1000, ticks=600, ack_delay=6, seed=None):
+    """Replicate `entities` autopiloted headless hunts for `ticks` ticks,
+    acking each snapshot ack_delay ticks late (the round trip), and report
+    bytes per tick for full and delta snapshots plus encode/decode time"""
+    games = [FoxTreasureHuntGame(headless=True, verbose=False, seed=None if seed is None else seed + i)
+             for i in range(entities)]
+    for game in games:
+        game.start_game()
+    ids = list(range(entities))
+    full_encoder, encoder, decoder = SnapshotEncoder(), SnapshotEncoder(), SnapshotDecoder()
+    in_flight = deque()
+    full_bytes = delta_bytes = 0
+    encode_s = decode_s = 0.0
+    for tick in range(ticks):
+        for game in games:
+            if game.game_state in ('won', 'lost'):
+                game.apply_script_command('restart')
+            command = autopilot(game)
+            if command:
+                game.handle_command(command)
+            game.tick()
+        rows = [quantize_game(game) for game in games]
+        full_bytes += len(full_encoder.encode(ids, rows))
+        start = time.perf_counter()
+        packet = encoder.encode(ids, rows)
+        encode_s += time.perf_counter() - start
+        start = time.perf_counter()
+        seq, _, values = decoder.decode(packet)
+        decode_s += time.perf_counter() - start
+        if not np.array_equal(values, np.asarray(rows, dtype=np.int64)):
+            raise AssertionError(f"snapshot {seq} did not round-trip")
+        delta_bytes += len(packet)
+        in_flight.append(seq)
+        if len(in_flight) > ack_delay:
+            encoder.ack(in_flight.popleft())
+    per_thousand = 1000 / entities
+    print("="*60)
+    print(f"SNAPSHOT BENCHMARK: {entities} entities, {ticks} ticks, acks {ack_delay} ticks late")
+    print(f"Fixed: {entities * (2 + 4 * len(SNAPSHOT_FIELDS)):9d} bytes/tick (uint16 id + int32 per field)")
+    print(f"Full:  {full_bytes / ticks:9.0f} bytes/tick ({full_bytes / ticks / entities:.1f} per entity)")
+    print(f"Delta: {delta_bytes / ticks:9.0f} bytes/tick ({delta_bytes / ticks / entities:.1f} per entity, "
+          f"{delta_bytes / full_bytes:.0%} of full)")
+    print(f"Per 1000 entities: encode {encode_s / ticks * 1000 * per_thousand:.2f} ms, "
+          f"decode {decode_s / ticks * 1000 * per_thousand:.2f} ms")
+    print("="*60)
+    return {'full_bytes_per_tick': full_bytes / ticks, 'delta_bytes_per_tick': delta_bytes / ticks,
+            'encode_ms': encode_s / ticks * 1000, 'decode_ms': decode_s / ticks * 1000}
+
+
+def run_swarm(count=10000, seed=None, density=1, max_seconds=600):
+    """Play `count` autopiloted foxes to won/lost in one FoxSwarm and report
+    outcomes and speed against ticking FoxTreasureHuntGame instances"""
+    environment = TreasureHuntEnvironment(density=density, verbose=False, seed=seed)
+    swarm = FoxSwarm(environment, count, seed)
+    finished_at = np.zeros(count)
+    near_house = np.zeros(count)
+    started = time.perf_counter()
+    while (swarm.state == 0).any() and swarm.ticks < max_seconds * SIM_HZ:
+        swarm.command(swarm.autopilot())
+        playing = swarm.state == 0
+        swarm.step()
+        finished_at[playing & (swarm.state != 0)] = swarm.ticks * SIM_DT
+        if swarm.ticks % 6 == 0:
+            near_house += (swarm.near_houses() >= 0) & playing
+    elapsed = time.perf_counter() - started
+    
+    sample = [FoxTreasureHuntGame(headless=True, verbose=False, seed=seed, density=density) for _ in range(100)]
+    for game in sample:
+        game.start_game()
+    scalar_started = time.perf_counter()
+    for _ in range(300):
+        for game in sample:
+            command = autopilot(game)
+            if command:
+                game.handle_command(command)
+            game.tick()
+    scalar_fox_ticks = 100 * 300 / (time.perf_counter() - scalar_started)
+    
+    won = swarm.state == SWARM_STATES.index('won')
+    finished = finished_at[finished_at > 0]
+    average_finish = f"{finished.mean():.1f}s" if finished.size else "none finished"
+    print("="*60)
+    print(f"SWARM: {count} foxes, {swarm.ticks} ticks in {elapsed:.2f}s "
+          f"({swarm.ticks / elapsed:.0f} ticks/s, {count * swarm.ticks / elapsed:,.0f} fox-ticks/s)")
+    print(f"Scalar games: {scalar_fox_ticks:,.0f} fox-ticks/s (swarm is {count * swarm.ticks / elapsed / scalar_fox_ticks:.0f}x faster)")
+    print(f"Wins: {won.sum()}/{count} | Avg treasures: {swarm.treasures_found.mean():.2f}"
+          f" | Avg score: {swarm.score.mean():.0f} | Avg finish: {average_finish}")
+    print(f"Avg time near a house: {near_house.mean() * 6 * SIM_DT:.1f}s")
+    print("="*60)
+    return swarm
+
+
+def replay_session(path, headless=False, profile_csv=None):
+    """Re-run a recorded session with its seed, rendered or headless"""
+    header, entries = load_session(path)
+    game = FoxTreasureHuntGame(headless=headless, verbose=not headless, seed=header['seed'],
+                               density=header.get('density', 1), world=header.get('world', 'fixed'))
+    game.replay = deque(entries)
+    if profile_csv and not headless:
+        game.profiler.open_csv(profile_csv)
+    if not headless:
+        game.run()
+        return game.result()
+    started = time.perf_counter()
+    result = game.run_headless()
+    print("="*60)
+    print(f"REPLAY of {path} (seed {header['seed']}): {result} in {time.perf_counter() - started:.2f}s")
+    print("="*60)
+    return result
+
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description="3D Fox Treasure Hunt")
+    parser.add_argument('--headless', action='store_true', help="simulate games with no window or OpenGL")
+    parser.add_argument('--games', type=int, default=1, help="number of headless games to simulate")
+    parser.add_argument('--script', help="headless command script ('<seconds> <command>' per line)")
+    parser.add_argument('--autopilot', action='store_true', help="drive headless games with the seek bot")
+    parser.add_argument('--seed', type=int, help="base random seed for the world layout")
+    parser.add_argument('--record', help="record the seed and every command to a session log")
+    parser.add_argument('--replay', help="re-run a recorded session log (rendered, or with --headless)")
+    parser.add_argument('--world', choices=('fixed', 'streaming'), default='fixed',
+                        help="'streaming' surrounds the map with endless procedural terrain")
+    parser.add_argument('--profile-csv', help="write per-frame stage timings (ms) to a CSV file")
+    parser.add_argument('--port', help="serial port of the joystick (skips port detection)")
+    parser.add_argument('--replay-input', help="feed the game from a '<seconds> <command>' file instead of Bluetooth")
+    parser.add_argument('--bench-input', action='store_true', help="benchmark the input pipeline over a virtual serial port")
+    parser.add_argument('--rate', type=int, default=1000, help="commands per second for --bench-input")
+    parser.add_argument('--protocol', choices=('binary', 'text'), default='binary', help="wire protocol for --bench-input")
+    parser.add_argument('--swarm', type=int, metavar='FOXES', help="simulate many autopiloted foxes at once with numpy")
+    parser.add_argument('--density', type=int, default=1, help="world density for --swarm")
+    parser.add_argument('--bench-snapshots', type=int, metavar='ENTITIES', help="benchmark snapshot delta replication")
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    if args.replay:
+        replay_session(args.replay, args.headless, args.profile_csv)
+        raise SystemExit
+    if args.headless:
+        run_batch(args.games, load_script(args.script) if args.script else (),
+                  autopilot if args.autopilot else None, args.seed, args.record)
+        raise SystemExit
+    if args.bench_input:
+        benchmark_input(args.rate, protocol=args.protocol)
+        raise SystemExit
+    if args.swarm:
+        run_swarm(args.swarm, args.seed, args.density)
+        raise SystemExit
+    if args.bench_snapshots:
+        benchmark_snapshots(args.bench_snapshots, seed=args.seed)
+        raise SystemExit
     try:
-        game = FoxTreasureHuntGame()
+        backend = ReplayBackend(args.replay_input) if args.replay_input else None
+        game = FoxTreasureHuntGame(input_backend=backend, port=args.port, seed=args.seed, world=args.world)
+        if args.record:
+            game.recorder = SessionRecorder(args.record, game.environment.seed, game.environment.density,
+                                            game.environment.world)
+        if args.profile_csv:
+            game.profiler.open_csv(args.profile_csv)
         game.run()
     except Exception as e:
         print(f"\nError: {e}")
@@ -0,0 +1,250 @@
+"""
+Offscreen rendering benchmark for the Fox Treasure Hunt world.
+
+Builds TreasureHuntEnvironment at several densities, flies a scripted camera
+through it and reports frame times, draw calls and memory as JSON. Runs on
+CPU-only machines through EGL (surfaceless Mesa) or OSMesa, no window needed:
+
+    python benchmark.py --densities 1 10 100 --modes instanced baked --output bench.json
+"""
+
+import argparse
+import ctypes
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fox Treasure Hunt rendering benchmark")
+    parser.add_argument('--densities', type=int, nargs='+', default=[1, 10, 100],
+                        help="world densities (multiplies trees, bushes, flowers and houses)")
+    parser.add_argument('--modes', nargs='+', default=['instanced', 'baked'],
+                        choices=['instanced', 'baked', 'immediate'], help="environment render modes")
+    parser.add_argument('--frames', type=int, default=300, help="frames along the camera path")
+    parser.add_argument('--warmup', type=int, default=10, help="untimed frames before measuring")
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    parser.add_argument('--platform', choices=['egl', 'osmesa'], default='egl', help="offscreen GL provider")
+    parser.add_argument('--seed', type=int, default=1, help="world seed")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    return parser.parse_args()
+
+
+ARGS = parse_args() if __name__ == '__main__' else None
+# PyOpenGL picks its platform at import time, so this has to precede Codes
+if ARGS:
+    os.environ['PYOPENGL_PLATFORM'] = ARGS.platform
+    if ARGS.platform == 'egl':
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+import numpy as np
+from OpenGL.GL import (GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT, GL_RENDERER, GL_UNSIGNED_BYTE, GL_VERSION,
+                       glClear, glFinish, glGetString, glLoadIdentity)
+import Codes
+
+
+def create_context(provider, width, height):
+    """Make an offscreen GL context current; returns objects that must stay alive"""
+    if provider == 'osmesa':
+        from OpenGL import osmesa, arrays
+        context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        buffer = arrays.GLubyteArray.zeros((height, width, 4))
+        if not context or not osmesa.OSMesaMakeCurrent(context, buffer, GL_UNSIGNED_BYTE, width, height):
+            raise RuntimeError("OSMesa context creation failed")
+        return context, buffer
+    from OpenGL import EGL
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("eglInitialize failed")
+    attributes = (EGL.EGLint * 13)(
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+        EGL.EGL_DEPTH_SIZE, 24,
+        EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_NONE)
+    config, count = EGL.EGLConfig(), EGL.EGLint()
+    if not EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count)) or not count.value:
+        raise RuntimeError("no EGL config with a pbuffer and desktop OpenGL")
+    surface = EGL.eglCreatePbufferSurface(display, config, (EGL.EGLint * 5)(
+        EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE))
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError("eglMakeCurrent failed")
+    return display, surface, context
+
+
+def camera_path(frame, frames):
+    """Walk a loop through the middle of the world at the game's camera height,
+    looking along the direction of travel; returns eye and fox positions"""
+    angle = 2 * np.pi * frame / frames
+    ahead = angle + 0.35
+    eye = (28 * np.sin(angle), 6.0, -20 + 40 * np.cos(angle))
+    fox = (28 * np.sin(ahead), 0.0, -20 + 40 * np.cos(ahead))
+    return eye, fox
+
+
+# Entry points that submit geometry to GL; a display list call counts once
+DRAW_CALLS = ('glCallList', 'glDrawArrays', 'glDrawArraysInstanced', 'glBegin', 'gluSphere', 'gluCylinder')
+
+
+class DrawCallCounter:
+    """Counts draw submissions by wrapping the GL names Codes looks up as globals"""
+
+    def __init__(self):
+        self.counts = dict.fromkeys(DRAW_CALLS, 0)
+        self.originals = {}
+
+    def __enter__(self):
+        for name in DRAW_CALLS:
+            original = getattr(Codes, name)
+            self.originals[name] = original
+
+            def counted(*args, name=name, original=original):
+                self.counts[name] += 1
+                return original(*args)
+            setattr(Codes, name, counted)
+        return self
+
+    def __exit__(self, *exc):
+        for name, original in self.originals.items():
+            setattr(Codes, name, original)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+NO_LABELS = [1e6, 0, 1e6]
+
+
+def render_frame(environment, fox, eye, fox_pos):
+    fox.position = [fox_pos[0], fox_pos[1], fox_pos[2]]
+    fox.rotation[1] = float(np.degrees(np.arctan2(eye[0] - fox_pos[0], eye[2] - fox_pos[2])))
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+    glLoadIdentity()
+    Codes.gluLookAt(eye[0], eye[1], eye[2], fox_pos[0], fox_pos[1] + 1, fox_pos[2], 0, 1, 0)
+    # House labels use GLUT bitmap fonts, and freeglut exits the process when
+    # it has no display to initialise against, so keep them out of range
+    environment.draw(NO_LABELS)
+    fox.draw()
+
+
+def run_scenario(density, mode, args):
+    geometry = Codes.GeometryCache()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    environment = Codes.TreasureHuntEnvironment(geometry, render_mode=mode, density=density,
+                                                verbose=False, seed=args.seed)
+    generated = time.perf_counter()
+    if mode != 'immediate':
+        environment.bake_static_scene()
+    glFinish()
+    baked = time.perf_counter()
+    fox = Codes.Fox3D(geometry)
+
+    for frame in range(args.warmup):
+        render_frame(environment, fox, *camera_path(frame, args.frames))
+    glFinish()
+
+    frame_ms = []
+    for frame in range(args.frames):
+        start = time.perf_counter()
+        render_frame(environment, fox, *camera_path(frame, args.frames))
+        glFinish()
+        frame_ms.append((time.perf_counter() - start) * 1000)
+
+    # Separate pass so the wrappers don't slow the timed frames
+    draw_calls = []
+    culled = []
+    with DrawCallCounter() as counter:
+        for frame in range(0, args.frames, max(args.frames // 30, 1)):
+            before = counter.total
+            render_frame(environment, fox, *camera_path(frame, args.frames))
+            draw_calls.append(counter.total - before)
+            culled.append(environment.cull_stats['culled'])
+    glFinish()
+
+    result = {
+        'density': density,
+        'mode': environment.render_mode,
+        'objects': {
+            'trees': len(environment.trees),
+            'bushes': len(environment.bushes),
+            'flowers': len(environment.flowers),
+            'houses': len(environment.houses),
+        },
+        'frames': args.frames,
+        'fps': round(1000 * len(frame_ms) / sum(frame_ms), 2),
+        'frame_ms': {
+            'mean': round(float(np.mean(frame_ms)), 3),
+            'p50': round(float(np.percentile(frame_ms, 50)), 3),
+            'p95': round(float(np.percentile(frame_ms, 95)), 3),
+            'p99': round(float(np.percentile(frame_ms, 99)), 3),
+            'max': round(float(np.max(frame_ms)), 3),
+        },
+        'draw_calls_per_frame': {
+            'mean': round(float(np.mean(draw_calls)), 1),
+            'max': int(np.max(draw_calls)),
+            'by_entry_point': {name: round(count / len(draw_calls), 1)
+                               for name, count in counter.counts.items() if count},
+        },
+        'culled_objects_per_frame': round(float(np.mean(culled)), 1),
+        'setup_ms': {
+            'generate': round((generated - started) * 1000, 1),
+            'bake': round((baked - generated) * 1000, 1),
+        },
+        'memory_mb': {
+            'rss_delta': round(rss_mb() - rss_before, 1),
+            'peak_rss': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'display_lists': len(geometry.lists),
+        },
+    }
+    environment.invalidate_static_scene()
+    geometry.release()
+    return result
+
+
+def main(args):
+    keep_alive = create_context(args.platform, args.width, args.height)
+    Codes.setup_gl((args.width, args.height))
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': args.platform,
+        'gl_renderer': glGetString(GL_RENDERER).decode(),
+        'gl_version': glGetString(GL_VERSION).decode(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'resolution': [args.width, args.height],
+        'seed': args.seed,
+        'results': [],
+    }
+    for density in args.densities:
+        for mode in args.modes:
+            result = run_scenario(density, mode, args)
+            report['results'].append(result)
+            print(f"density {density:>4}x {result['mode']:>9}: {result['fps']:8.1f} FPS, "
+                  f"p95 {result['frame_ms']['p95']:7.2f} ms, "
+                  f"{result['draw_calls_per_frame']['mean']:7.0f} draw calls", file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    del keep_alive
+    return report
+
+
+if __name__ == '__main__':
+    main(ARGS)
@@ -3,6 +3,11 @@
  * 
  * Joystick Power is hardcoded to come from Pin 9 (acts as 5V output)
  * Bluetooth baud rate set to 38400
+ *
+ * Sends text commands ("forward\r\n") until the game writes "PROTO BIN",
+ * then switches to compact binary frames:
+ *   0xA5, opcode, seq, payload..., checksum (xor of opcode, seq, payload)
+ * Axis frames carry both joystick axes as signed bytes and stream at 100 Hz.
  */
 
 #include <SoftwareSerial.h>
@@ -32,6 +37,17 @@
 // Timing
 #define COMMAND_DELAY 300
 #define DEBOUNCE_DELAY 50
+#define AXIS_PERIOD 10      // ms between binary axis frames (100 Hz)
+
+// Binary protocol (must match FRAME_COMMANDS in Codes.py)
+#define FRAME_SYNC 0xA5
+#define OP_HELLO 0x00
+#define OP_AXIS 0x01
+#define OP_JUMP 0x17
+#define OP_WAVE 0x18
+#define OP_DANCE 0x19
+#define OP_RESET 0x1A
+#define PROTOCOL_VERSION 1
 
 // Create software serial for Bluetooth
 SoftwareSerial BTSerial(BT_RX, BT_TX);
@@ -51,6 +67,13 @@ unsigned long lastCommandTime = 0;
 // Movement state
 String lastCommand = "";
 
+// Protocol state
+bool binaryMode = false;
+byte frameSeq = 0;
+unsigned long lastAxisTime = 0;
+unsigned long ledOffTime = 0;
+String inputLine = "";
+
 void setup() {
   // Initialize serial communications
   Serial.begin(9600);          // For debugging via Serial Monitor
@@ -83,6 +106,13 @@ void setup() {
 }
 
 void loop() {
+  checkHandshake();
+
+  if (binaryMode) {
+    binaryLoop();
+    return;
+  }
+
   int xValue = analogRead(JOY_X);
   int yValue = analogRead(JOY_Y);
 
@@ -121,6 +151,84 @@ void loop() {
   delay(50);
 }
 
+// Binary mode: no blocking delays, axes streamed every AXIS_PERIOD ms and
+// buttons sent as single frames the moment they are pressed.
+void binaryLoop() {
+  unsigned long now = millis();
+  if (now - lastAxisTime >= AXIS_PERIOD) {
+    lastAxisTime = now;
+    byte payload[2];
+    payload[0] = (byte)axisByte(analogRead(JOY_X));
+    payload[1] = (byte)axisByte(analogRead(JOY_Y));
+    sendFrame(OP_AXIS, payload, 2);
+  }
+
+  checkButtonFrame(JUMP_BTN, &jumpBtnLastState, &lastJumpPress, OP_JUMP);
+  checkButtonFrame(WAVE_BTN, &waveBtnLastState, &lastWavePress, OP_WAVE);
+  checkButtonFrame(DANCE_BTN, &danceBtnLastState, &lastDancePress, OP_DANCE);
+  checkButtonFrame(JOY_BTN, &joyBtnLastState, &lastJoyPress, OP_RESET);
+
+  if (ledOffTime && now >= ledOffTime) {
+    digitalWrite(LED_BUILTIN, LOW);
+    ledOffTime = 0;
+  }
+}
+
+int axisByte(int value) {
+  int scaled = (value - JOY_CENTER) / 4;
+  return constrain(scaled, -127, 127);
+}
+
+// "PROTO BIN" switches to binary frames (answered with a HELLO frame),
+// "PROTO TEXT" switches back.
+void checkHandshake() {
+  while (BTSerial.available()) {
+    char c = BTSerial.read();
+    if (c == '\n') {
+      inputLine.trim();
+      if (inputLine == "PROTO BIN") {
+        binaryMode = true;
+        byte version = PROTOCOL_VERSION;
+        sendFrame(OP_HELLO, &version, 1);
+        Serial.println("Binary protocol enabled");
+      } else if (inputLine == "PROTO TEXT") {
+        binaryMode = false;
+        Serial.println("Text protocol enabled");
+      }
+      inputLine = "";
+    } else if (inputLine.length() < 16) {
+      inputLine += c;
+    }
+  }
+}
+
+void sendFrame(byte opcode, byte *payload, byte length) {
+  byte checksum = opcode ^ frameSeq;
+  BTSerial.write(FRAME_SYNC);
+  BTSerial.write(opcode);
+  BTSerial.write(frameSeq);
+  for (byte i = 0; i < length; i++) {
+    BTSerial.write(payload[i]);
+    checksum ^= payload[i];
+  }
+  BTSerial.write(checksum);
+  frameSeq++;
+}
+
+void checkButtonFrame(int pin, bool *lastState, unsigned long *lastPress, byte opcode) {
+  bool currentState = digitalRead(pin);
+  if (currentState == LOW && *lastState == HIGH) {
+    if (millis() - *lastPress > DEBOUNCE_DELAY) {
+      byte magnitude = 255;
+      sendFrame(opcode, &magnitude, 1);
+      *lastPress = millis();
+      digitalWrite(LED_BUILTIN, HIGH);
+      ledOffTime = millis() + 50;
+    }
+  }
+  *lastState = currentState;
+}
+
 void checkButton(int pin, bool *lastState, unsigned long *lastPress, String cmd) {
   bool currentState = digitalRead(pin);
   if (currentState == LOW && *lastState == HIGH) {
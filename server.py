@@ -0,0 +1,307 @@
+"""
+Authoritative Fox Treasure Hunt server: many independent headless hunts in
+one asyncio process, all ticked together at the game's fixed SIM_HZ.
+
+Each client connection owns one session (its own FoxTreasureHuntGame, so its
+own Fox3D, TreasureHuntEnvironment and timer). Clients send one command per
+line, the joystick vocabulary handle_command understands plus 'start',
+'restart', 'quit', 'axis,x,y' and 'ping <token>'. The server answers with
+one JSON state line every few ticks and 'pong <token> <tick>' once a ping
+has been processed by a tick.
+
+A client that sends 'watch' becomes a viewer of every hunt instead: from
+then on it receives binary snapshot packets (Codes.SnapshotEncoder deltas,
+each prefixed with its uint32 length) and answers 'ack <seq>' so later
+packets only carry what changed since a snapshot it holds.
+
+    python server.py serve --port 8765
+    python server.py load --clients 300 --seconds 20
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+from collections import deque
+
+import Codes
+
+DEFAULT_PORT = 8765
+STATE_EVERY = 6            # ticks between state lines (10 Hz at 60 Hz)
+MAX_WRITE_BUFFER = 64 * 1024
+MAX_SESSIONS = 0xFFFF      # session ids are 16-bit in snapshot packets
+COMMANDS_PER_TICK = 16     # per session; a joystick sends a few per tick at most
+MAX_PENDING = 256          # queued commands before a session's reads pause
+
+
+class Session:
+    """One hunt and the connection that drives it"""
+
+    def __init__(self, session_id, writer, seed=None):
+        self.id = session_id
+        self.writer = writer
+        self.game = Codes.FoxTreasureHuntGame(headless=True, verbose=False, seed=seed)
+        self.pending = deque()
+        self.room = asyncio.Event()
+        self.room.set()
+        self.closed = False
+        self.snapshots = None
+
+    def step(self):
+        game = self.game
+        # Bounded so one flooding client can't stretch the tick every session shares
+        for _ in range(min(len(self.pending), COMMANDS_PER_TICK)):
+            command = self.pending.popleft()
+            if command.startswith('ping '):
+                self.send(f"pong {command[5:]} {game.ticks}")
+            elif command == 'watch':
+                self.snapshots = Codes.SnapshotEncoder()
+            elif command.startswith('ack ') and self.snapshots:
+                if command[4:].isdigit():
+                    self.snapshots.ack(int(command[4:]))
+            else:
+                game.apply_script_command(command)
+        if len(self.pending) < MAX_PENDING:
+            self.room.set()
+        if not game.running:
+            self.closed = True
+            return
+        if self.snapshots:
+            return
+        game.tick()
+        if game.ticks % STATE_EVERY == 0:
+            self.send(json.dumps(self.state(), separators=(',', ':')))
+
+    def state(self):
+        game = self.game
+        treasure = game.environment.current_treasure
+        return {
+            'tick': game.ticks,
+            'state': game.game_state,
+            'pos': [round(game.fox.position[0], 2), round(game.fox.position[1], 2), round(game.fox.position[2], 2)],
+            'rot': round(game.fox.rotation[1], 1),
+            'timer': round(game.timer, 2),
+            'treasures': game.treasures_found,
+            'score': game.score,
+            'hint': treasure['hint'] if treasure else None,
+        }
+
+    def send(self, line):
+        self.write(line.encode('utf-8') + b'\n')
+
+    def write(self, data):
+        # A client that stops reading loses state lines rather than growing our buffer
+        transport = self.writer.transport
+        if transport.is_closing():
+            self.closed = True
+        elif transport.get_write_buffer_size() < MAX_WRITE_BUFFER:
+            self.writer.write(data)
+
+
+class HuntServer:
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.sessions = {}
+        self.next_id = 1
+        self.tick_ms = []
+        self.late_ticks = 0
+        self.ticks = 0
+
+    def allocate_id(self):
+        """Lowest free id from next_id on; snapshot packets carry 16-bit ids"""
+        for offset in range(MAX_SESSIONS):
+            session_id = (self.next_id - 1 + offset) % MAX_SESSIONS + 1
+            if session_id not in self.sessions:
+                self.next_id = session_id % MAX_SESSIONS + 1
+                return session_id
+        return None
+
+    async def handle_client(self, reader, writer):
+        session_id = self.allocate_id()
+        if session_id is None:
+            writer.write(json.dumps({'error': 'server full'}).encode('utf-8') + b'\n')
+            writer.close()
+            return
+        seed = None if self.seed is None else self.seed + session_id
+        session = Session(session_id, writer, seed)
+        self.sessions[session_id] = session
+        session.send(json.dumps({'session': session_id, 'seed': session.game.environment.seed, 'sim_hz': Codes.SIM_HZ}))
+        try:
+            while not session.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', errors='ignore').strip()
+                if command:
+                    session.pending.append(command)
+                    if len(session.pending) >= MAX_PENDING:
+                        # Stop reading until ticks catch up; TCP then pushes back on the client
+                        session.room.clear()
+                        await session.room.wait()
+        except (ConnectionError, ValueError, asyncio.LimitOverrunError):
+            # ValueError is what readline raises for a line over the stream limit
+            pass
+        finally:
+            session.closed = True
+            self.sessions.pop(session_id, None)
+            writer.close()
+
+    async def tick_loop(self):
+        """Fixed-rate tick of every session; if a tick overruns by more than
+        MAX_FRAME_TIME the schedule is reset instead of spiralling"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            started = time.perf_counter()
+            for session in list(self.sessions.values()):
+                try:
+                    session.step()
+                except Exception as e:
+                    print(f"session {session.id} failed and was closed: {e!r}")
+                    session.closed = True
+                if session.closed:
+                    session.room.set()
+                    session.writer.close()
+            self.ticks += 1
+            if self.ticks % STATE_EVERY == 0:
+                self.send_snapshots()
+            self.tick_ms.append((time.perf_counter() - started) * 1000)
+            next_tick += Codes.SIM_DT
+            delay = next_tick - loop.time()
+            if delay < 0:
+                self.late_ticks += 1
+                if delay < -Codes.MAX_FRAME_TIME:
+                    next_tick = loop.time()
+            await asyncio.sleep(max(delay, 0))
+
+    def send_snapshots(self):
+        watchers = [session for session in self.sessions.values() if session.snapshots]
+        if not watchers:
+            return
+        players = [session for session in self.sessions.values() if not session.snapshots]
+        ids = [session.id for session in players]
+        rows = [Codes.quantize_game(session.game) for session in players]
+        for watcher in watchers:
+            packet = watcher.snapshots.encode(ids, rows)
+            watcher.write(struct.pack('<I', len(packet)) + packet)
+
+    async def report_loop(self, every=5.0):
+        while True:
+            await asyncio.sleep(every)
+            samples, self.tick_ms = self.tick_ms, []
+            if samples:
+                samples.sort()
+                print(f"sessions {len(self.sessions):5d} | ticks/s {len(samples) / every:5.1f} | "
+                      f"tick p50 {samples[len(samples) // 2]:6.2f} ms, max {samples[-1]:6.2f} ms | "
+                      f"late {self.late_ticks}")
+
+    async def serve(self, host, port, unix=None):
+        if unix:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix)
+            where = unix
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+            where = f"{host}:{port}"
+        print("="*60)
+        print(f"FOX TREASURE HUNT SERVER on {where} ({Codes.SIM_HZ} Hz)")
+        print("="*60)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.tick_loop(), self.report_loop())
+
+
+async def load_client(index, host, port, unix, seconds, stats):
+    """Joystick-like bot: seeks the treasure with a command every 100 ms and pings now and then"""
+    if unix:
+        reader, writer = await asyncio.open_unix_connection(unix)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    rng = random.Random(index)
+    pings = {}
+    state = json.loads(await reader.readline())
+
+    async def read():
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            stats['lines'] += 1
+            if line.startswith(b'pong '):
+                token = line.split()[1].decode()
+                stats['rtt'].append(time.perf_counter() - pings.pop(token))
+            elif line.startswith(b'{'):
+                update = json.loads(line)
+                if update.get('state') in ('won', 'lost') and state.get('state') not in ('won', 'lost'):
+                    stats['finished'] += 1
+                state.update(update)
+
+    reading = asyncio.create_task(read())
+    writer.write(b'start\n')
+    deadline = time.perf_counter() + seconds
+    sequence = 0
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0.1 + rng.uniform(-0.02, 0.02))
+        if state.get('state') in ('won', 'lost'):
+            command = 'restart'
+        else:
+            command = rng.choice(['forward', 'forward', 'rotate_left', 'rotate_right', 'jump'])
+        writer.write(command.encode() + b'\n')
+        stats['commands'] += 1
+        if sequence % 10 == 0:
+            token = f"{index}-{sequence}"
+            pings[token] = time.perf_counter()
+            writer.write(f"ping {token}\n".encode())
+        sequence += 1
+    writer.write(b'quit\n')
+    await writer.drain()
+    reading.cancel()
+    writer.close()
+
+
+async def run_load(clients, host, port, unix, seconds, ramp):
+    stats = {'lines': 0, 'commands': 0, 'finished': 0, 'rtt': []}
+    tasks = []
+    for i in range(clients):
+        tasks.append(asyncio.create_task(load_client(i, host, port, unix, seconds, stats)))
+        await asyncio.sleep(ramp / clients)
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started + ramp
+    rtt = sorted(stats['rtt'])
+    print("="*60)
+    print(f"LOAD: {clients} clients for {seconds:g}s")
+    print(f"Commands sent: {stats['commands']} ({stats['commands'] / elapsed:.0f}/s) | "
+          f"lines received: {stats['lines']} ({stats['lines'] / elapsed:.0f}/s)")
+    print(f"Hunts finished: {stats['finished']}")
+    if rtt:
+        print(f"Ping round trip: p50 {rtt[len(rtt) // 2] * 1000:.1f} ms, "
+              f"p99 {rtt[int(len(rtt) * 0.99)] * 1000:.1f} ms, max {rtt[-1] * 1000:.1f} ms")
+    print("="*60)
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fox Treasure Hunt session server")
+    sub = parser.add_subparsers(dest='mode', required=True)
+    for name in ('serve', 'load'):
+        mode = sub.add_parser(name)
+        mode.add_argument('--host', default='127.0.0.1')
+        mode.add_argument('--port', type=int, default=DEFAULT_PORT)
+        mode.add_argument('--unix', help="use a Unix domain socket at this path instead of TCP")
+    sub.choices['serve'].add_argument('--seed', type=int, help="base world seed (session n uses seed + n)")
+    sub.choices['load'].add_argument('--clients', type=int, default=100)
+    sub.choices['load'].add_argument('--seconds', type=float, default=10.0)
+    sub.choices['load'].add_argument('--ramp', type=float, default=2.0, help="seconds over which clients connect")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        if args.mode == 'serve':
+            asyncio.run(HuntServer(args.seed).serve(args.host, args.port, args.unix))
+        else:
+            asyncio.run(run_load(args.clients, args.host, args.port, args.unix, args.seconds, args.ramp))
+    except KeyboardInterrupt:
+        pass
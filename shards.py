@@ -0,0 +1,566 @@
+"""
+Multi-process sharding for headless Fox Treasure Hunt sessions.
+
+One Python process is capped by the GIL, so ShardSupervisor spreads hunts
+(each its own FoxTreasureHuntGame: environment, fox and timer) over worker
+processes. Each worker has two shared-memory rings: commands in, and out
+the command log, checkpoints and snapshot deltas (Codes.SnapshotEncoder) of
+all its hunts.
+
+The supervisor keeps, per hunt, its latest checkpoint (the pickled game,
+taken every CHECKPOINT_EVERY ticks) and the commands applied since. A
+crashed or hung worker is replaced and its hunts rebuilt from checkpoint
+plus log up to the last tick it reported; rebalancing moves live hunts from
+the busiest worker to the idlest one the same way.
+
+    python shards.py bench --workers 1 2 4 8 --sessions 4000 --seconds 10
+    python shards.py bench --workers 4 --sessions 1000 --paced --chaos 5
+"""
+
+import argparse
+import json
+import multiprocessing
+import pickle
+import random
+import struct
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import Codes
+
+RING_BYTES = 8 * 2 ** 20
+RING_HEADER = 128          # head and tail counters on separate cache lines
+SNAPSHOT_EVERY = 6         # worker ticks between snapshots
+CHECKPOINT_EVERY = 600     # game ticks between checkpoints of one hunt
+WORKER_TIMEOUT = 5.0       # seconds without output before a worker counts as hung
+REBALANCE_EVERY = 2.0      # seconds
+REBALANCE_SLACK = 1.25     # busiest/idlest tick cost ratio tolerated
+REBALANCE_MIN_MS = 2.0     # tick cost below which a worker is never drained
+COMMANDS_PER_TICK = 2000   # commands a worker applies between two ticks
+HEARTBEAT_EVERY = 0.5      # seconds between heartbeats while a worker restores hunts
+
+MESSAGE = struct.Struct('<cH')     # kind, session id
+NUMBER = struct.Struct('<I')       # supervisor's command number
+COMMAND = struct.Struct('<HIH')    # session id, command number, command length in a batch
+LOGGED = struct.Struct('<II')      # tick the command was applied at, its number
+SPEC = struct.Struct('<I')         # length of the JSON part of an add message
+SNAPSHOT = struct.Struct('<cIfH')  # kind, worker tick, CPU ms per tick, sessions
+
+
+class ShmRing:
+    """Single-producer single-consumer ring of length-prefixed messages in
+    shared memory. head and tail are free-running byte counts, each written
+    by one side only, so neither side takes a lock"""
+
+    def __init__(self, name=None, capacity=RING_BYTES):
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=RING_HEADER + capacity)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.counters = np.ndarray((RING_HEADER // 8,), np.uint64, self.shm.buf[:RING_HEADER])
+        if self.owner:
+            self.counters[:] = 0
+            self.counters[1] = capacity
+        self.capacity = int(self.counters[1])
+        self.data = np.ndarray((self.capacity,), np.uint8, self.shm.buf[RING_HEADER:RING_HEADER + self.capacity])
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, payload):
+        """Append one message; False if the reader is too far behind"""
+        frame = np.frombuffer(struct.pack('<I', len(payload)) + payload, np.uint8)
+        head, tail = int(self.counters[0]), int(self.counters[8])
+        if self.capacity - (head - tail) < len(frame):
+            return False
+        start = head % self.capacity
+        first = min(len(frame), self.capacity - start)
+        self.data[start:start + first] = frame[:first]
+        self.data[:len(frame) - first] = frame[first:]
+        self.counters[0] = head + len(frame)
+        return True
+
+    def read(self, limit=None):
+        """Complete messages written so far, at most limit of them"""
+        head, tail = int(self.counters[0]), int(self.counters[8])
+        messages = []
+        while tail < head and (limit is None or len(messages) < limit):
+            size = struct.unpack('<I', self.take(tail, 4))[0]
+            messages.append(self.take(tail + 4, size))
+            tail += 4 + size
+        self.counters[8] = tail
+        return messages
+
+    def take(self, offset, size):
+        start = offset % self.capacity
+        first = min(size, self.capacity - start)
+        if first == size:
+            return self.data[start:start + size].tobytes()
+        return self.data[start:].tobytes() + self.data[:size - first].tobytes()
+
+    def close(self):
+        del self.counters, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class Outbox:
+    """Worker side of the out ring; messages wait in a backlog while the
+    ring is full, except snapshots, which are skipped"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.backlog = deque()
+
+    def send(self, message):
+        if self.backlog or not self.ring.write(message):
+            self.backlog.append(message)
+
+    def flush(self):
+        while self.backlog and self.ring.write(self.backlog[0]):
+            self.backlog.popleft()
+        return not self.backlog
+
+
+class RingLog:
+    """Stands in for a SessionRecorder: every command a hunt applies goes
+    back to the supervisor with its tick and command number"""
+
+    def __init__(self, outbox, session_id):
+        self.outbox = outbox
+        self.session_id = session_id
+        self.number = 0
+        self.logged = False
+
+    def record(self, tick, command):
+        self.outbox.send(MESSAGE.pack(b'L', self.session_id) + LOGGED.pack(tick, self.number)
+                         + command.encode('utf-8'))
+        self.logged = True
+
+
+def checkpoint(game):
+    recorder, game.recorder = game.recorder, None
+    data = pickle.dumps(game, pickle.HIGHEST_PROTOCOL)
+    game.recorder = recorder
+    return data
+
+
+def restore_game(spec, data):
+    """Rebuild a hunt from its checkpoint (or seed) and replay its log up to spec['tick']"""
+    if data:
+        game = pickle.loads(data)
+    else:
+        game = Codes.FoxTreasureHuntGame(headless=True, verbose=False, seed=spec['seed'], density=spec['density'])
+    game.replay = deque(tuple(entry) for entry in spec['log'])
+    while game.ticks < spec['tick'] and game.running:
+        game.tick()
+    game.apply_replay()
+    game.replay = None
+    return game
+
+
+def worker_main(inbox_name, outbox_name, paced):
+    inbox = ShmRing(inbox_name)
+    outbox = Outbox(ShmRing(outbox_name))
+    encoder = Codes.SnapshotEncoder()
+    games = {}
+    commands = deque()
+    ticks = 0
+    busy = 0.0
+    next_tick = time.monotonic()
+    heartbeat = time.monotonic()
+    while True:
+        moving = []
+        # Stop reading while a backlog of commands is waiting, so a flood of
+        # input queues up in the rings instead of starving the ticks
+        for message in inbox.read() if len(commands) < COMMANDS_PER_TICK else ():
+            kind, session_id = MESSAGE.unpack_from(message)
+            if kind == b'B':
+                offset = MESSAGE.size
+                while offset < len(message):
+                    session_id, number, size = COMMAND.unpack_from(message, offset)
+                    offset += COMMAND.size
+                    commands.append((session_id, number, message[offset:offset + size].decode('utf-8')))
+                    offset += size
+            elif kind == b'A':
+                size = SPEC.unpack_from(message, MESSAGE.size)[0]
+                start = MESSAGE.size + SPEC.size
+                game = restore_game(json.loads(message[start:start + size]), message[start + size:])
+                game.recorder = RingLog(outbox, session_id)
+                games[session_id] = game
+                if time.monotonic() - heartbeat > HEARTBEAT_EVERY:
+                    heartbeat = time.monotonic()
+                    outbox.send(MESSAGE.pack(b'H', 0))
+            elif kind == b'M':
+                moving.append(session_id)
+            elif kind == b'Q':
+                inbox.close()
+                outbox.ring.close()
+                return
+        for _ in range(min(len(commands), COMMANDS_PER_TICK)):
+            session_id, number, command = commands.popleft()
+            game = games.get(session_id)
+            if not game:
+                continue
+            game.recorder.number = number
+            game.recorder.logged = False
+            game.apply_script_command(command)
+            if not game.recorder.logged:
+                outbox.send(MESSAGE.pack(b'K', session_id) + NUMBER.pack(number))
+        started = time.process_time()
+        for session_id, game in list(games.items()):
+            game.tick()
+            if not game.running:
+                del games[session_id]
+                outbox.send(MESSAGE.pack(b'E', session_id))
+            elif game.ticks % CHECKPOINT_EVERY == session_id % CHECKPOINT_EVERY:
+                outbox.send(MESSAGE.pack(b'P', session_id) + NUMBER.pack(game.ticks) + checkpoint(game))
+        busy += time.process_time() - started
+        # Released right after a tick, the same point periodic checkpoints are taken
+        for session_id in moving:
+            game = games.pop(session_id, None)
+            if game:
+                outbox.send(MESSAGE.pack(b'R', session_id) + NUMBER.pack(game.ticks) + checkpoint(game))
+        ticks += 1
+        if ticks % SNAPSHOT_EVERY == 0 and outbox.flush():
+            ids = sorted(games)
+            packet = encoder.encode(ids, [Codes.quantize_game(games[i]) for i in ids])
+            game_ticks = np.array([games[i].ticks for i in ids], '<u4').tobytes()
+            if outbox.ring.write(SNAPSHOT.pack(b'S', ticks, busy * 1000 / SNAPSHOT_EVERY, len(ids)) + game_ticks + packet):
+                encoder.ack(encoder.seq)
+            busy = 0.0
+        if paced:
+            next_tick += Codes.SIM_DT
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -Codes.MAX_FRAME_TIME:
+                next_tick = time.monotonic()
+
+
+class Worker:
+    """Supervisor's handle on one worker process and its rings"""
+
+    def __init__(self, index, context, paced):
+        self.index = index
+        self.inbox = ShmRing()
+        self.outbox = ShmRing()
+        self.process = context.Process(target=worker_main, args=(self.inbox.name, self.outbox.name, paced),
+                                       name=f"shard-{index}", daemon=True)
+        self.process.start()
+        self.pending = deque()
+        self.batch = []
+        self.decoder = Codes.SnapshotDecoder()
+        self.sessions = set()
+        self.tick_ms = None
+        self.ticks = 0
+        self.last_seen = time.monotonic()
+
+    def send(self, message):
+        self.end_batch()
+        if self.pending or not self.inbox.write(message):
+            self.pending.append(message)
+
+    def command(self, session_id, number, command):
+        """Queue a command; the queued ones travel as one batch message"""
+        data = command.encode('utf-8')
+        self.batch.append(COMMAND.pack(session_id, number, len(data)) + data)
+
+    def end_batch(self):
+        if self.batch:
+            message = MESSAGE.pack(b'B', 0) + b''.join(self.batch)
+            self.batch = []
+            if self.pending or not self.inbox.write(message):
+                self.pending.append(message)
+
+    def flush(self):
+        self.end_batch()
+        while self.pending and self.inbox.write(self.pending[0]):
+            self.pending.popleft()
+
+    def close(self, timeout=2.0):
+        if self.process.is_alive():
+            self.inbox.write(MESSAGE.pack(b'Q', 0))
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.inbox.close()
+        self.outbox.close()
+
+
+class Session:
+    """Everything needed to rebuild a hunt on any worker"""
+
+    def __init__(self, session_id, seed, density):
+        self.id = session_id
+        self.seed = seed
+        self.density = density
+        self.checkpoint = b''
+        self.log = []
+        self.unconfirmed = deque()
+        self.tick = 0
+        self.worker = None
+        self.moving_to = None
+
+    def add_message(self):
+        # Logged commands may be newer than the last snapshot; replay them all
+        tick = max([self.tick] + [entry[0] for entry in self.log[-1:]])
+        spec = json.dumps({'seed': self.seed, 'density': self.density, 'tick': tick,
+                           'log': self.log}).encode('utf-8')
+        return MESSAGE.pack(b'A', self.id) + SPEC.pack(len(spec)) + spec + self.checkpoint
+
+    def save_checkpoint(self, tick, data):
+        self.checkpoint = data
+        self.log = [entry for entry in self.log if entry[0] >= tick]
+        self.tick = max(self.tick, tick)
+
+    def confirm(self, number):
+        while self.unconfirmed and self.unconfirmed[0][0] <= number:
+            self.unconfirmed.popleft()
+
+
+class ShardSupervisor:
+    """Runs hunts on a pool of worker processes.
+
+    add_session/send/remove_session drive hunts by id; poll() must be called
+    regularly: it collects logs, checkpoints and snapshots (the latest
+    quantised row of every hunt lands in self.states), restarts dead or hung
+    workers and rebalances. Session ids are 16-bit, as in snapshot packets.
+    """
+
+    def __init__(self, workers=None, paced=True, seed=None):
+        self.context = multiprocessing.get_context('spawn')
+        self.paced = paced
+        self.seed = seed
+        self.workers = [Worker(i, self.context, paced) for i in range(workers or multiprocessing.cpu_count())]
+        self.sessions = {}
+        self.states = {}
+        self.next_id = 1
+        self.next_number = 1
+        self.restarts = 0
+        self.migrations = 0
+        self.last_rebalance = time.monotonic()
+
+    def add_session(self, seed=None, density=1):
+        for offset in range(0xFFFF):
+            session_id = (self.next_id - 1 + offset) % 0xFFFF + 1
+            if session_id not in self.sessions:
+                break
+        else:
+            raise RuntimeError("all 65535 session ids are in use")
+        self.next_id = session_id % 0xFFFF + 1
+        if seed is None:
+            seed = random.randrange(2 ** 32) if self.seed is None else self.seed + session_id
+        session = Session(session_id, seed, density)
+        self.sessions[session_id] = session
+        self.assign(session, min(self.workers, key=lambda worker: len(worker.sessions)))
+        return session_id
+
+    def assign(self, session, worker):
+        session.worker = worker
+        worker.sessions.add(session.id)
+        worker.send(session.add_message())
+        for number, command in session.unconfirmed:
+            worker.command(session.id, number, command)
+
+    def send(self, session_id, command):
+        session = self.sessions.get(session_id)
+        if not session:
+            return False
+        number, self.next_number = self.next_number, self.next_number + 1
+        session.unconfirmed.append((number, command))
+        if session.moving_to is None:
+            session.worker.command(session_id, number, command)
+        return True
+
+    def remove_session(self, session_id):
+        self.send(session_id, 'quit')
+
+    def poll(self):
+        now = time.monotonic()
+        for worker in list(self.workers):
+            worker.flush()
+            self.collect(worker)
+            if not worker.process.is_alive() or now - worker.last_seen > WORKER_TIMEOUT:
+                self.restart(worker)
+        if now - self.last_rebalance > REBALANCE_EVERY:
+            self.last_rebalance = now
+            self.rebalance()
+
+    def collect(self, worker):
+        for message in worker.outbox.read():
+            worker.last_seen = time.monotonic()
+            kind = message[:1]
+            if kind == b'S':
+                _, worker.ticks, tick_ms, count = SNAPSHOT.unpack_from(message)
+                if worker.tick_ms is None:
+                    worker.tick_ms = tick_ms
+                else:
+                    worker.tick_ms += (tick_ms - worker.tick_ms) * 0.1
+                game_ticks = np.frombuffer(message, '<u4', count, SNAPSHOT.size)
+                _, ids, rows = worker.decoder.decode(message[SNAPSHOT.size + 4 * count:])
+                for session_id, tick, row in zip(ids.tolist(), game_ticks.tolist(), rows):
+                    session = self.sessions.get(session_id)
+                    if session and session.worker is worker:
+                        session.tick = tick
+                        self.states[session_id] = row
+                continue
+            _, session_id = MESSAGE.unpack_from(message)
+            session = self.sessions.get(session_id)
+            if not session or session.worker is not worker:
+                continue
+            if kind == b'L':
+                tick, number = LOGGED.unpack_from(message, MESSAGE.size)
+                session.log.append((tick, message[MESSAGE.size + LOGGED.size:].decode('utf-8')))
+                session.confirm(number)
+            elif kind == b'K':
+                session.confirm(NUMBER.unpack_from(message, MESSAGE.size)[0])
+            elif kind == b'P':
+                session.save_checkpoint(NUMBER.unpack_from(message, MESSAGE.size)[0], message[MESSAGE.size + NUMBER.size:])
+            elif kind == b'R':
+                session.save_checkpoint(NUMBER.unpack_from(message, MESSAGE.size)[0], message[MESSAGE.size + NUMBER.size:])
+                worker.sessions.discard(session_id)
+                target, session.moving_to = session.moving_to, None
+                if target not in self.workers:
+                    target = worker
+                self.assign(session, target)
+                self.migrations += 1
+                # Both costs changed; measure them afresh before rebalancing again
+                worker.tick_ms = target.tick_ms = None
+            elif kind == b'E':
+                worker.sessions.discard(session_id)
+                del self.sessions[session_id]
+                self.states.pop(session_id, None)
+
+    def restart(self, worker):
+        """Replace a dead or hung worker and rebuild its hunts from checkpoints and logs"""
+        reason = 'exited' if not worker.process.is_alive() else 'stopped responding'
+        print(f"shard-{worker.index} {reason}; restarting with {len(worker.sessions)} sessions")
+        worker.close(timeout=0)
+        replacement = Worker(worker.index, self.context, self.paced)
+        self.workers[self.workers.index(worker)] = replacement
+        self.restarts += 1
+        for session in self.sessions.values():
+            if session.moving_to is worker:
+                session.moving_to = replacement
+            if session.worker is worker:
+                session.moving_to = None
+                self.assign(session, replacement)
+
+    def rebalance(self):
+        """When the busiest worker's tick cost exceeds the idlest one's by
+        REBALANCE_SLACK, move hunts between them until their world sizes
+        (summed densities, the dominant cost of a tick) are even"""
+        if any(worker.tick_ms is None for worker in self.workers) or any(
+                session.moving_to for session in self.sessions.values()):
+            return
+        busiest = max(self.workers, key=lambda worker: worker.tick_ms)
+        idlest = min(self.workers, key=lambda worker: worker.tick_ms)
+        if (busiest is idlest or busiest.tick_ms < REBALANCE_MIN_MS
+                or busiest.tick_ms < idlest.tick_ms * REBALANCE_SLACK):
+            return
+        excess = (self.weight(busiest) - self.weight(idlest)) / 2
+        for session_id in list(busiest.sessions):
+            session = self.sessions[session_id]
+            if session.density > excess:
+                break
+            excess -= session.density
+            session.moving_to = idlest
+            busiest.send(MESSAGE.pack(b'M', session_id))
+
+    def weight(self, worker):
+        return sum(self.sessions[session_id].density for session_id in worker.sessions)
+
+    def row(self, session_id):
+        """Latest state of a hunt as Codes.dequantize_row values"""
+        row = self.states.get(session_id)
+        return None if row is None else Codes.dequantize_row(row)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.close()
+
+
+def run_bench(workers, sessions, seconds, paced, chaos, seed):
+    """Drive `sessions` hunts with joystick-like bots; returns session ticks per second"""
+    supervisor = ShardSupervisor(workers, paced, seed)
+    rng = random.Random(seed)
+    ids = [supervisor.add_session() for _ in range(sessions)]
+    for session_id in ids:
+        supervisor.send(session_id, 'start')
+    while any(worker.ticks == 0 for worker in supervisor.workers):
+        supervisor.poll()
+        time.sleep(0.01)
+    start_ticks = {session_id: session.tick for session_id, session in supervisor.sessions.items()}
+    worker_ticks = {worker.index: worker.ticks for worker in supervisor.workers}
+    started = time.monotonic()
+    next_chaos = started + chaos if chaos else None
+    while time.monotonic() - started < seconds:
+        for session_id in rng.sample(ids, max(1, len(ids) // 10)):
+            row = supervisor.states.get(session_id)
+            if row is not None and Codes.SNAPSHOT_STATES[row[10]] in ('won', 'lost'):
+                supervisor.send(session_id, 'restart')
+            else:
+                supervisor.send(session_id, rng.choice(['forward', 'forward', 'rotate_left', 'rotate_right', 'jump']))
+        supervisor.poll()
+        if next_chaos and time.monotonic() > next_chaos:
+            rng.choice(supervisor.workers).process.kill()
+            next_chaos += chaos
+        time.sleep(0.01)
+    elapsed = time.monotonic() - started
+    session_ticks = sum(session.tick - start_ticks.get(session_id, 0)
+                        for session_id, session in supervisor.sessions.items())
+    # A replacement worker counts its ticks from zero again
+    ran = {worker.index: worker.ticks - worker_ticks[worker.index] if worker.ticks >= worker_ticks[worker.index]
+           else worker.ticks for worker in supervisor.workers}
+    result = {
+        'workers': len(supervisor.workers),
+        'sessions': len(supervisor.sessions),
+        'session_ticks_per_s': session_ticks / elapsed,
+        'worker_tick_ms': [round(worker.tick_ms or 0, 2) for worker in supervisor.workers],
+        'restarts': supervisor.restarts,
+        'migrations': supervisor.migrations,
+        'stalled': [index for index, ticks in sorted(ran.items()) if ticks < elapsed],
+    }
+    supervisor.stop()
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fox Treasure Hunt multi-process sharding")
+    sub = parser.add_subparsers(dest='mode', required=True)
+    bench = sub.add_parser('bench', help="session ticks per second against worker count")
+    bench.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    bench.add_argument('--sessions', type=int, default=1000)
+    bench.add_argument('--seconds', type=float, default=10.0)
+    bench.add_argument('--paced', action='store_true', help="tick at SIM_HZ instead of as fast as possible")
+    bench.add_argument('--chaos', type=float, help="kill a random worker every this many seconds")
+    bench.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print("="*60)
+    print(f"SHARD BENCHMARK: {args.sessions} sessions, {args.seconds:g}s, "
+          f"{'paced' if args.paced else 'unpaced'}, {multiprocessing.cpu_count()} CPUs")
+    print("="*60)
+    single = None
+    for count in args.workers:
+        result = run_bench(count, args.sessions, args.seconds, args.paced, args.chaos, args.seed)
+        if result['stalled']:
+            scaling = f"STALLED workers {result['stalled']}"
+        else:
+            single = single or result['session_ticks_per_s'] / count
+            scaling = f"{result['session_ticks_per_s'] / (single * count):.0%} of linear"
+        print(f"{count:3d} workers: {result['session_ticks_per_s']:10.0f} session ticks/s ({scaling}) | "
+              f"restarts {result['restarts']} | migrations {result['migrations']} | "
+              f"tick ms {result['worker_tick_ms']}")
+    print("="*60)